@@ -4,7 +4,11 @@ Called once on app startup.
 """
 
 import json
-from .models import get_db
+import uuid
+from .models import acquire_db
+
+# Bump when adding a migration below (stored in PRAGMA user_version)
+SCHEMA_VERSION = 1
 
 DEFAULT_SCHEMA = json.dumps(
     {
@@ -114,8 +118,7 @@ PDF_TEXT:
 
 
 async def init_database():
-    db = await get_db()
-    try:
+    async with acquire_db(write=True) as db:
         # ── Create tables ──
         await db.executescript(
             """
@@ -125,6 +128,7 @@ async def init_database():
                 pages INTEGER,
                 extracted_text TEXT,
                 metadata TEXT,
+                sections_json TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
 
@@ -154,27 +158,39 @@ async def init_database():
                 last_run_at TIMESTAMP,
                 FOREIGN KEY (workflow_id) REFERENCES workflows(id)
             );
+
+            CREATE TABLE IF NOT EXISTS vision_cache (
+                key TEXT PRIMARY KEY,
+                description TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_workflows_created_at ON workflows(created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_runs_workflow_id ON runs(workflow_id);
+            CREATE INDEX IF NOT EXISTS idx_runs_document_id ON runs(document_id);
             """
         )
 
-        # Add metadata column if it doesn't exist (migration-safe)
-        try:
-            await db.execute("ALTER TABLE documents ADD COLUMN metadata TEXT")
-            await db.commit()
-        except Exception:
-            pass  # Column already exists
+        # ── Column migrations for databases created by older versions ──
+        # PRAGMA user_version records that they ran, so warm boots skip them.
+        # sqlite3 runs DDL outside an implicit transaction, so no commit needed.
+        cursor = await db.execute("PRAGMA user_version")
+        if (await cursor.fetchone())[0] < SCHEMA_VERSION:
+            cursor = await db.execute("PRAGMA table_info(documents)")
+            columns = {row["name"] for row in await cursor.fetchall()}
+            for column in ("metadata", "sections_json"):
+                if column not in columns:
+                    await db.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")
+            await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
         # ── Seed workflows if table is empty ──
         cursor = await db.execute("SELECT COUNT(*) FROM workflows")
         row = await cursor.fetchone()
         if row[0] == 0:
-            import uuid
-
-            # Workflow 1: Clinical Paper Triage (quick)
             wf1_id = str(uuid.uuid4())
-            await db.execute(
-                """INSERT INTO workflows (id, name, description, prompt_template, output_schema_json, created_by)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
+            wf2_id = str(uuid.uuid4())
+            seed_workflows = [
+                # Workflow 1: Clinical Paper Triage (quick)
                 (
                     wf1_id,
                     "Clinical Paper Triage → Summary, Biomarkers, Trial Phase, Next Experiments",
@@ -183,16 +199,7 @@ async def init_database():
                     DEFAULT_SCHEMA,
                     "system",
                 ),
-            )
-            await db.execute(
-                "INSERT INTO usage (workflow_id, run_count) VALUES (?, 0)", (wf1_id,)
-            )
-
-            # Workflow 2: Deep Paper Analysis with Visual Elements
-            wf2_id = str(uuid.uuid4())
-            await db.execute(
-                """INSERT INTO workflows (id, name, description, prompt_template, output_schema_json, created_by)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
+                # Workflow 2: Deep Paper Analysis with Visual Elements
                 (
                     wf2_id,
                     "Deep Paper Analysis → Full Extraction with Figures, Tables & Safety Data",
@@ -201,16 +208,22 @@ async def init_database():
                     DEEP_ANALYSIS_SCHEMA,
                     "system",
                 ),
+            ]
+
+            # One transaction, one executemany per table — use the same
+            # pattern for any future bulk insert (e.g. batch runs).
+            await db.executemany(
+                """INSERT INTO workflows (id, name, description, prompt_template, output_schema_json, created_by)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                seed_workflows,
             )
-            await db.execute(
-                "INSERT INTO usage (workflow_id, run_count) VALUES (?, 0)", (wf2_id,)
+            await db.executemany(
+                "INSERT INTO usage (workflow_id, run_count) VALUES (?, 0)",
+                [(wf[0],) for wf in seed_workflows],
             )
 
             await db.commit()
             print(f"✅ Seeded workflow 1 (Quick Triage): {wf1_id}")
             print(f"✅ Seeded workflow 2 (Deep Analysis): {wf2_id}")
 
-        await db.commit()
         print("✅ Database initialised")
-    finally:
-        await db.close()
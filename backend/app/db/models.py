@@ -1,18 +1,91 @@
 """
 SQLite database models and helpers (async via aiosqlite).
-Tables: documents, workflows, runs, usage
+Tables: documents, workflows, runs, usage, vision_cache
+
+Connections are long-lived: one writer (serialised by a lock) plus a pool of
+readers, opened once at startup and reused by every request.
 """
 
+import asyncio
 import aiosqlite
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data", "app.db")
 
+_readers: asyncio.Queue | None = None
+_writer: aiosqlite.Connection | None = None
+_writer_lock = asyncio.Lock()
+_all_connections: list[aiosqlite.Connection] = []
 
-async def get_db() -> aiosqlite.Connection:
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    db = await aiosqlite.connect(DB_PATH)
+
+async def _open_connection() -> aiosqlite.Connection:
+    # Pooled connections live for the whole process, so give sqlite3 room to
+    # keep every statement the app issues prepared (default is 128)
+    db = await aiosqlite.connect(DB_PATH, cached_statements=256)
     db.row_factory = aiosqlite.Row
     await db.execute("PRAGMA journal_mode=WAL")
     await db.execute("PRAGMA foreign_keys=ON")
+    # WAL + NORMAL is crash-safe and only fsyncs at checkpoints, not per commit
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+    await db.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    await db.execute("PRAGMA busy_timeout=5000")
     return db
+
+
+async def init_pool(size: int = 8) -> None:
+    """Open the writer + `size` reader connections. Called once from lifespan."""
+    global _readers, _writer
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+
+    _writer = await _open_connection()
+    _all_connections.append(_writer)
+
+    _readers = asyncio.Queue(maxsize=size)
+    for _ in range(size):
+        conn = await _open_connection()
+        _all_connections.append(conn)
+        _readers.put_nowait(conn)
+
+
+async def close_pool() -> None:
+    """Close every pooled connection. Called on shutdown."""
+    global _readers, _writer
+    for conn in _all_connections:
+        await conn.close()
+    _all_connections.clear()
+    _readers = None
+    _writer = None
+
+
+@asynccontextmanager
+async def acquire_db(write: bool = False) -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Borrow a pooled connection.
+    write=True → the single writer (exclusive for the duration of the block);
+    write=False → any free reader.
+
+    DML inside one write block shares sqlite3's implicit transaction, so
+    multi-statement writes should issue a single commit() at the end.
+    """
+    if _writer is None or _readers is None:
+        raise RuntimeError("Database pool not initialised — call init_pool() first")
+
+    if write:
+        async with _writer_lock:
+            try:
+                yield _writer
+            finally:
+                # Never leak a half-finished transaction to the next borrower
+                if _writer.in_transaction:
+                    await _writer.rollback()
+        return
+
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
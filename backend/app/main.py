@@ -2,6 +2,9 @@
 AIXplore Team Workflow Library – FastAPI backend
 """
 
+import os
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,16 +12,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Services log per-figure / per-chunk detail at DEBUG; LOG_LEVEL=DEBUG shows it
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(levelname)s:     %(name)s - %(message)s",
+)
+
 from app.db.init_db import init_database
+from app.db.models import init_pool, close_pool
+from app.services.doc_intel import shutdown_image_pool
+from app.services.grounding import load_tokenizer
+from app.utils.paths import ensure_data_dirs
 from app.routes import documents, workflows, runs
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    ensure_data_dirs()
+    await init_pool()
     await init_database()
+    # May download tiktoken's BPE file on first boot — keep it off the loop
+    await asyncio.to_thread(load_tokenizer)
     yield
-    # Shutdown (nothing to clean up)
+    # Shutdown
+    await close_pool()
+    await asyncio.to_thread(shutdown_image_pool)
 
 
 app = FastAPI(
@@ -1,21 +1,29 @@
 """
 POST /api/documents/parse – upload PDF, extract text via Azure Document Intelligence.
-GET  /api/documents/{doc_id}/figure/{index} – serve a figure image as PNG.
+GET  /api/documents/{doc_id}/figure/{index} – serve a figure image (JPEG or PNG).
 """
 
+import asyncio
 import uuid
 import os
-import json
-import base64
-from io import BytesIO
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import Response
-from app.db.models import get_db
+import orjson
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from app.db.models import acquire_db
 from app.services.doc_intel import parse_pdf
+from app.services.figure_store import save_figures, figure_path
+from app.utils.paths import PARSED_DIR
 
 router = APIRouter(prefix="/api/documents", tags=["documents"])
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+FIGURE_CACHE_CONTROL = "public, max-age=86400, immutable"
+
+
+def _save_original_content(doc_id: str, content: str) -> None:
+    original_path = os.path.join(PARSED_DIR, f"{doc_id}_original.txt")
+    with open(original_path, "w", encoding="utf-8") as f:
+        f.write(content)
 
 
 @router.post("/parse")
@@ -23,12 +31,22 @@ async def parse_document(file: UploadFile = File(...)):
     if not file.filename or not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
 
-    file_bytes = await file.read()
-    if len(file_bytes) == 0:
+    # Starlette has already spooled the upload (in memory up to 1 MB, then to
+    # disk), so pass that file object through instead of copying it into bytes.
+    size = file.size
+    if size is None:
+        file.file.seek(0, os.SEEK_END)
+        size = file.file.tell()
+    if size == 0:
         raise HTTPException(status_code=400, detail="Empty file.")
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB).",
+        )
 
     try:
-        result = await parse_pdf(file_bytes, filename=file.filename)
+        result = await parse_pdf(file.file, filename=file.filename)
     except Exception as e:
         raise HTTPException(
             status_code=502,
@@ -37,40 +55,32 @@ async def parse_document(file: UploadFile = File(...)):
 
     doc_id = str(uuid.uuid4())
 
-    # Store in DB — include sections, span data, tables HTML for enriched .md later
-    metadata = json.dumps({
-        "sections": result.get("sections", []),
+    # Store in DB — sections get their own column (every run needs them);
+    # span data + tables HTML are only read when building the enriched .md
+    sections_json = orjson.dumps(result.get("sections", [])).decode()
+    metadata = orjson.dumps({
         "figure_count": len(result.get("figure_images", [])),
         "tables_count": len(result.get("tables_md", [])),
         "tables_html": result.get("tables_html", []),
         "table_spans": result.get("table_spans", []),
         "figure_spans": result.get("figure_spans", []),
-    })
+    }).decode()
 
-    db = await get_db()
-    try:
+    async with acquire_db(write=True) as db:
         await db.execute(
-            "INSERT INTO documents (id, filename, pages, extracted_text, metadata) VALUES (?, ?, ?, ?, ?)",
-            (doc_id, file.filename, result["pages"], result["text"], metadata),
+            """INSERT INTO documents (id, filename, pages, extracted_text, metadata, sections_json)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (doc_id, file.filename, result["pages"], result["text"], metadata, sections_json),
         )
         await db.commit()
-    finally:
-        await db.close()
 
-    # Store figure images for the run step + UI serving
-    figures_dir = os.path.join(DATA_DIR, "figures")
-    os.makedirs(figures_dir, exist_ok=True)
+    # Store figure images (one JPEG or PNG file each) for the run step + UI serving.
+    # File writes can be tens of MB, so keep them off the event loop.
     if result.get("figure_images"):
-        figures_path = os.path.join(figures_dir, f"{doc_id}.json")
-        with open(figures_path, "w") as f:
-            json.dump(result["figure_images"], f)
+        await asyncio.to_thread(save_figures, doc_id, result["figure_images"])
 
     # Store original content for enriched .md generation after run
-    original_dir = os.path.join(DATA_DIR, "parsed")
-    os.makedirs(original_dir, exist_ok=True)
-    original_path = os.path.join(original_dir, f"{doc_id}_original.txt")
-    with open(original_path, "w", encoding="utf-8") as f:
-        f.write(result.get("original_content", ""))
+    await asyncio.to_thread(_save_original_content, doc_id, result.get("original_content", ""))
 
     return {
         "doc_id": doc_id,
@@ -84,22 +94,27 @@ async def parse_document(file: UploadFile = File(...)):
 
 
 @router.get("/{doc_id}/figure/{index}")
-async def get_figure_image(doc_id: str, index: int):
-    """Serve a figure image as PNG by doc_id and 1-based figure index."""
-    figures_path = os.path.join(DATA_DIR, "figures", f"{doc_id}.json")
-    if not os.path.exists(figures_path):
-        raise HTTPException(status_code=404, detail="No figures for this document")
-
-    with open(figures_path, "r") as f:
-        figures = json.load(f)
-
-    for fig in figures:
-        if fig["index"] == index:
-            img_bytes = base64.b64decode(fig["image_base64"])
-            return Response(
-                content=img_bytes,
-                media_type="image/png",
-                headers={"Cache-Control": "public, max-age=86400"},
-            )
-
-    raise HTTPException(status_code=404, detail=f"Figure {index} not found")
+async def get_figure_image(doc_id: str, index: int, request: Request):
+    """Serve a figure image by doc_id and 1-based figure index."""
+    found = await asyncio.to_thread(figure_path, doc_id, index)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Figure {index} not found")
+    path, mime_type, stat_result = found
+
+    # FileResponse derives Content-Length / Last-Modified / ETag from the stat
+    response = FileResponse(
+        path,
+        media_type=mime_type,
+        headers={"Cache-Control": FIGURE_CACHE_CONTROL},
+        stat_result=stat_result,
+    )
+
+    # Revalidation: answer a matching If-None-Match with an empty 304
+    etag = response.headers["etag"]
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+        return Response(
+            status_code=304,
+            headers={"ETag": etag, "Cache-Control": FIGURE_CACHE_CONTROL},
+        )
+    return response
@@ -4,20 +4,37 @@ GET  /api/runs/{run_id}/download – download run output as JSON.
 GET  /api/runs/{run_id}/download-md – download enriched markdown.
 """
 
+import asyncio
 import uuid
-import json
+import orjson
 import os
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from typing import Optional
-from app.db.models import get_db
+from app.db.models import acquire_db
+from app.routes.workflows import load_workflow
 from app.services.workflow_runner import run_workflow
+from app.services.figure_store import has_figures, load_figure_images
 from app.services.enriched_md import build_enriched_markdown, save_enriched_markdown
+from app.utils.paths import PARSED_DIR, RUNS_DIR
 
 router = APIRouter(prefix="/api/runs", tags=["runs"])
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+# ── Hot-path SQL (kept as constants so sqlite3's statement cache always hits) ──
+SQL_GET_DOCUMENT = "SELECT filename, metadata, sections_json FROM documents WHERE id = ?"
+SQL_GET_DOCUMENT_WITH_TEXT = (
+    "SELECT filename, metadata, sections_json, extracted_text FROM documents WHERE id = ?"
+)
+SQL_INSERT_RUN = (
+    "INSERT INTO runs (id, workflow_id, document_id, output_json) VALUES (?, ?, ?, ?)"
+)
+SQL_UPSERT_USAGE = """INSERT INTO usage (workflow_id, run_count, last_run_at)
+    VALUES (?, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT(workflow_id) DO UPDATE SET
+      run_count = run_count + 1,
+      last_run_at = CURRENT_TIMESTAMP
+    RETURNING run_count"""
 
 
 class RunCreate(BaseModel):
@@ -26,129 +43,147 @@ class RunCreate(BaseModel):
     input_text: Optional[str] = None
 
 
+def _build_enriched_md(
+    doc_id: str,
+    run_id: str,
+    metadata_json: str | None,
+    figure_descriptions: list[dict],
+    filename: str,
+) -> str:
+    """Build + save the enriched .md for a run. Returns its path, or "" if unavailable."""
+    original_path = os.path.join(PARSED_DIR, f"{doc_id}_original.txt")
+    if not os.path.exists(original_path):
+        print(f"⚠️ Original content file not found: {original_path}")
+        return ""
+
+    # Span data + tables HTML are only needed here, so decode them here
+    metadata = orjson.loads(metadata_json) if metadata_json else {}
+
+    with open(original_path, "r", encoding="utf-8") as f:
+        original_content = f.read()
+    enriched_content = build_enriched_markdown(
+        original_content=original_content,
+        table_spans=metadata.get("table_spans", []),
+        tables_html=metadata.get("tables_html", []),
+        figure_spans=metadata.get("figure_spans", []),
+        figure_descriptions=figure_descriptions,
+        filename=filename,
+    )
+    return save_enriched_markdown(enriched_content, run_id)
+
+
+def _save_run_output(run_id: str, payload: dict) -> None:
+    run_output_path = os.path.join(RUNS_DIR, f"{run_id}.json")
+    with open(run_output_path, "wb") as f:
+        f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+
+
+async def _fetch_document(doc_id: str, with_text: bool):
+    # Skip the (large) extracted_text when the caller sent its own
+    sql = SQL_GET_DOCUMENT_WITH_TEXT if with_text else SQL_GET_DOCUMENT
+    async with acquire_db() as db:
+        cursor = await db.execute(sql, (doc_id,))
+        return await cursor.fetchone()
+
+
+async def _record_run(run_id: str, workflow_id: str, doc_id: str, output_str: str) -> int:
+    """Insert the run + bump usage; returns the workflow's new run_count."""
+    async with acquire_db(write=True) as db:
+        await db.execute(SQL_INSERT_RUN, (run_id, workflow_id, doc_id, output_str))
+
+        # Update usage and read back the new count in the same statement
+        cursor = await db.execute(SQL_UPSERT_USAGE, (workflow_id,))
+        run_count = (await cursor.fetchone())["run_count"]
+        await db.commit()
+    return run_count
+
+
 @router.post("")
 async def execute_run(body: RunCreate):
-    db = await get_db()
-    try:
-        # Fetch workflow
-        cursor = await db.execute(
-            "SELECT * FROM workflows WHERE id = ?", (body.workflow_id,)
-        )
-        workflow = await cursor.fetchone()
-        if not workflow:
-            raise HTTPException(status_code=404, detail="Workflow not found")
-        workflow = dict(workflow)
-
-        # Fetch document
-        cursor = await db.execute(
-            "SELECT * FROM documents WHERE id = ?", (body.doc_id,)
+    # Workflow definition (cached in-process), document row and the figure
+    # check don't depend on each other, so look them up concurrently
+    workflow, doc, doc_has_figures = await asyncio.gather(
+        load_workflow(body.workflow_id),
+        _fetch_document(body.doc_id, with_text=not body.input_text),
+        asyncio.to_thread(has_figures, body.doc_id),
+    )
+    if not workflow:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Get text
+    text = body.input_text if body.input_text else doc["extracted_text"]
+    if not text:
+        raise HTTPException(
+            status_code=400, detail="No text available for processing"
         )
-        doc = await cursor.fetchone()
-        if not doc:
-            raise HTTPException(status_code=404, detail="Document not found")
-        doc = dict(doc)
-
-        # Get text
-        text = body.input_text if body.input_text else doc.get("extracted_text", "")
-        if not text:
-            raise HTTPException(
-                status_code=400, detail="No text available for processing"
-            )
-
-        # Get metadata (sections, span data, tables HTML)
-        sections = []
-        metadata = {}
-        if doc.get("metadata"):
-            metadata = json.loads(doc["metadata"])
-            sections = metadata.get("sections", [])
-
-        # Load figure images if available
-        figure_images = []
-        figures_path = os.path.join(DATA_DIR, "figures", f"{body.doc_id}.json")
-        if os.path.exists(figures_path):
-            with open(figures_path, "r") as f:
-                figure_images = json.load(f)
-
-        # Run the workflow
-        try:
-            result = await run_workflow(
-                prompt_template=workflow["prompt_template"],
-                output_schema_json=workflow["output_schema_json"],
-                input_text=text,
-                sections=sections,
-                figure_images=figure_images,
-                doc_id=body.doc_id,
-            )
-        except Exception as e:
-            raise HTTPException(
-                status_code=502,
-                detail=f"Azure OpenAI error: {str(e)}",
-            )
-
-        # ── Generate enriched .md ──
-        run_id = str(uuid.uuid4())
-        figure_descriptions = result.get("figure_descriptions", [])
-        grounding = result.get("grounding")
-
-        original_path = os.path.join(DATA_DIR, "parsed", f"{body.doc_id}_original.txt")
-        enriched_md_path = ""
-        if os.path.exists(original_path):
-            with open(original_path, "r", encoding="utf-8") as f:
-                original_content = f.read()
-            enriched_content = build_enriched_markdown(
-                original_content=original_content,
-                table_spans=metadata.get("table_spans", []),
-                tables_html=metadata.get("tables_html", []),
-                figure_spans=metadata.get("figure_spans", []),
-                figure_descriptions=figure_descriptions,
-                filename=doc.get("filename", "document.pdf"),
-            )
-            enriched_md_path = save_enriched_markdown(enriched_content, run_id)
-        else:
-            print(f"⚠️ Original content file not found: {original_path}")
 
-        # Save run output as downloadable JSON
-        output_str = json.dumps(result["parsed"]) if result["parsed"] else result["raw"]
-        runs_dir = os.path.join(DATA_DIR, "runs")
-        os.makedirs(runs_dir, exist_ok=True)
-        run_output_path = os.path.join(runs_dir, f"{run_id}.json")
-        with open(run_output_path, "w") as f:
-            json.dump({
-                "run_id": run_id,
-                "workflow_name": workflow["name"],
-                "document": doc.get("filename", ""),
-                "output": result["parsed"],
-                "figure_descriptions": figure_descriptions,
-                "grounding": grounding,
-                "raw_model_output": result["raw"],
-                "enriched_md_path": enriched_md_path,
-            }, f, indent=2)
-
-        await db.execute(
-            "INSERT INTO runs (id, workflow_id, document_id, output_json) VALUES (?, ?, ?, ?)",
-            (run_id, body.workflow_id, body.doc_id, output_str),
-        )
+    # Sections drive chunking. Documents parsed before sections_json existed
+    # still carry them inside the metadata blob.
+    sections = []
+    if doc["sections_json"]:
+        sections = orjson.loads(doc["sections_json"])
+    elif doc["metadata"]:
+        sections = orjson.loads(doc["metadata"]).get("sections", [])
+
+    # Figure images are read from disk only if run_workflow needs them
+    figure_loader = None
+    if doc_has_figures:
+        figure_loader = lambda: load_figure_images(body.doc_id)
 
-        # Update usage
-        await db.execute(
-            """INSERT INTO usage (workflow_id, run_count, last_run_at)
-               VALUES (?, 1, CURRENT_TIMESTAMP)
-               ON CONFLICT(workflow_id) DO UPDATE SET
-                 run_count = run_count + 1,
-                 last_run_at = CURRENT_TIMESTAMP""",
-            (body.workflow_id,),
+    # Run the workflow (no DB connection held during the LLM calls)
+    try:
+        result = await run_workflow(
+            prompt_template=workflow["prompt_template"],
+            output_schema_json=workflow["output_schema_json"],
+            input_text=text,
+            sections=sections,
+            doc_id=body.doc_id,
+            figure_loader=figure_loader,
+            prepared_prompt=workflow["prepared_prompt"],
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Azure OpenAI error: {str(e)}",
         )
-        await db.commit()
 
-        # Get updated run count
-        cursor = await db.execute(
-            "SELECT run_count FROM usage WHERE workflow_id = ?", (body.workflow_id,)
+    run_id = str(uuid.uuid4())
+    figure_descriptions = result.get("figure_descriptions", [])
+    grounding = result.get("grounding")
+    output_str = orjson.dumps(result["parsed"]).decode() if result["parsed"] else result["raw"]
+
+    async def _write_run_files() -> str:
+        # File reads/writes and the markdown build run in a worker thread so
+        # large documents don't stall the event loop.
+        enriched_md_path = await asyncio.to_thread(
+            _build_enriched_md,
+            body.doc_id,
+            run_id,
+            doc["metadata"],
+            figure_descriptions,
+            doc["filename"],
         )
-        usage_row = await cursor.fetchone()
-        run_count = dict(usage_row)["run_count"] if usage_row else 1
 
-    finally:
-        await db.close()
+        # Save run output as downloadable JSON
+        await asyncio.to_thread(_save_run_output, run_id, {
+            "run_id": run_id,
+            "workflow_name": workflow["name"],
+            "document": doc["filename"],
+            "output": result["parsed"],
+            "figure_descriptions": figure_descriptions,
+            "grounding": grounding,
+            "raw_model_output": result["raw"],
+            "enriched_md_path": enriched_md_path,
+        })
+        return enriched_md_path
+
+    # The files on disk and the DB rows are independent — write both at once
+    enriched_md_path, run_count = await asyncio.gather(
+        _write_run_files(),
+        _record_run(run_id, body.workflow_id, body.doc_id, output_str),
+    )
 
     return {
         "run_id": run_id,
@@ -164,7 +199,7 @@ async def execute_run(body: RunCreate):
 @router.get("/{run_id}/download")
 async def download_run_output(run_id: str):
     """Download the full run output as JSON."""
-    run_path = os.path.join(DATA_DIR, "runs", f"{run_id}.json")
+    run_path = os.path.join(RUNS_DIR, f"{run_id}.json")
     if not os.path.exists(run_path):
         raise HTTPException(status_code=404, detail="Run output file not found")
 
@@ -178,17 +213,17 @@ async def download_run_output(run_id: str):
 @router.get("/{run_id}/download-md")
 async def download_enriched_md(run_id: str):
     """Download the enriched markdown document."""
-    md_path = os.path.join(DATA_DIR, "runs", f"{run_id}_enriched.md")
+    md_path = os.path.join(RUNS_DIR, f"{run_id}_enriched.md")
     if not os.path.exists(md_path):
         raise HTTPException(status_code=404, detail="Enriched .md not found")
 
     # Try to get original filename from the run JSON
-    run_json_path = os.path.join(DATA_DIR, "runs", f"{run_id}.json")
+    run_json_path = os.path.join(RUNS_DIR, f"{run_id}.json")
     download_name = f"enriched_{run_id}.md"
     if os.path.exists(run_json_path):
         try:
-            with open(run_json_path, "r") as f:
-                run_data = json.load(f)
+            with open(run_json_path, "rb") as f:
+                run_data = orjson.loads(f.read())
             orig = run_data.get("document", "")
             if orig:
                 download_name = orig.replace(".pdf", "_enriched.md").replace(".PDF", "_enriched.md")
@@ -2,15 +2,41 @@
 /api/workflows – CRUD for workflows.
 """
 
+import asyncio
 import uuid
-import json
+import orjson
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from app.db.models import get_db
+from app.db.models import acquire_db
+from app.services.aoai import prepare_prompt
 
 router = APIRouter(prefix="/api/workflows", tags=["workflows"])
 
+# Workflow definitions are immutable after creation, so runs read them from
+# here instead of SQLite. Only the fields a run needs are kept (run_count
+# changes and always comes from the DB), plus the prompt with its schema
+# pre-substituted so runs only fill in {text}.
+_workflow_cache: dict[str, dict] = {}
+_workflow_cache_lock = asyncio.Lock()
+
+# ── Hot-path SQL (kept as constants so sqlite3's statement cache always hits) ──
+SQL_LIST_WORKFLOWS = """
+    SELECT w.*, COALESCE(u.run_count, 0) as run_count
+    FROM workflows w
+    LEFT JOIN usage u ON w.id = u.workflow_id
+    ORDER BY w.created_at DESC
+"""
+SQL_GET_WORKFLOW = """
+    SELECT w.*, COALESCE(u.run_count, 0) as run_count
+    FROM workflows w
+    LEFT JOIN usage u ON w.id = u.workflow_id
+    WHERE w.id = ?
+"""
+SQL_GET_WORKFLOW_DEFINITION = (
+    "SELECT id, name, prompt_template, output_schema_json FROM workflows WHERE id = ?"
+)
+
 
 class WorkflowCreate(BaseModel):
     name: str
@@ -20,58 +46,83 @@ class WorkflowCreate(BaseModel):
     created_by: Optional[str] = "user"
 
 
+def _cache_workflow(row) -> dict:
+    # Reuse the entry while the row's definition matches it (there is no
+    # updated_at; comparing the strings still catches out-of-band edits)
+    wf = _workflow_cache.get(row["id"])
+    if (
+        wf is not None
+        and wf["name"] == row["name"]
+        and wf["prompt_template"] == row["prompt_template"]
+        and wf["output_schema_json"] == row["output_schema_json"]
+    ):
+        return wf
+
+    wf = {
+        "name": row["name"],
+        "prompt_template": row["prompt_template"],
+        "output_schema_json": row["output_schema_json"],
+        "prepared_prompt": prepare_prompt(row["prompt_template"], row["output_schema_json"]),
+    }
+    _workflow_cache[row["id"]] = wf
+    return wf
+
+
+async def load_workflow(workflow_id: str) -> dict | None:
+    """Return {name, prompt_template, output_schema_json, prepared_prompt} for a workflow, or None."""
+    wf = _workflow_cache.get(workflow_id)
+    if wf is not None:
+        return wf
+
+    # Only the miss path takes the lock, so concurrent runs of a cold
+    # workflow share one DB read
+    async with _workflow_cache_lock:
+        wf = _workflow_cache.get(workflow_id)
+        if wf is not None:
+            return wf
+        async with acquire_db() as db:
+            cursor = await db.execute(SQL_GET_WORKFLOW_DEFINITION, (workflow_id,))
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        return _cache_workflow(row)
+
+
 @router.get("")
 async def list_workflows():
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            """
-            SELECT w.*, COALESCE(u.run_count, 0) as run_count
-            FROM workflows w
-            LEFT JOIN usage u ON w.id = u.workflow_id
-            ORDER BY w.created_at DESC
-            """
-        )
+    async with acquire_db() as db:
+        cursor = await db.execute(SQL_LIST_WORKFLOWS)
         rows = await cursor.fetchall()
+        for row in rows:
+            _cache_workflow(row)
         return [dict(row) for row in rows]
-    finally:
-        await db.close()
 
 
 @router.get("/{workflow_id}")
 async def get_workflow(workflow_id: str):
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            """
-            SELECT w.*, COALESCE(u.run_count, 0) as run_count
-            FROM workflows w
-            LEFT JOIN usage u ON w.id = u.workflow_id
-            WHERE w.id = ?
-            """,
-            (workflow_id,),
-        )
+    async with acquire_db() as db:
+        cursor = await db.execute(SQL_GET_WORKFLOW, (workflow_id,))
         row = await cursor.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Workflow not found")
+        _cache_workflow(row)
         return dict(row)
-    finally:
-        await db.close()
 
 
 @router.post("")
 async def create_workflow(body: WorkflowCreate):
-    # Validate that output_schema_json is valid JSON
+    # Validate that output_schema_json is valid JSON, and store it compacted —
+    # it is pasted into every prompt, so whitespace costs tokens on each run
     try:
-        json.loads(body.output_schema_json)
-    except json.JSONDecodeError:
+        schema = orjson.loads(body.output_schema_json)
+    except orjson.JSONDecodeError:
         raise HTTPException(
             status_code=400, detail="output_schema_json must be valid JSON"
         )
+    body.output_schema_json = orjson.dumps(schema).decode()
 
     wf_id = str(uuid.uuid4())
-    db = await get_db()
-    try:
+    async with acquire_db(write=True) as db:
         await db.execute(
             """INSERT INTO workflows (id, name, description, prompt_template, output_schema_json, created_by)
                VALUES (?, ?, ?, ?, ?, ?)""",
@@ -88,22 +139,20 @@ async def create_workflow(body: WorkflowCreate):
             "INSERT INTO usage (workflow_id, run_count) VALUES (?, 0)", (wf_id,)
         )
         await db.commit()
-    finally:
-        await db.close()
 
+    _cache_workflow({"id": wf_id, **body.model_dump()})
     return {"id": wf_id, "name": body.name, "message": "Workflow published successfully"}
 
 
 @router.delete("/{workflow_id}")
 async def delete_workflow(workflow_id: str):
-    db = await get_db()
-    try:
-        cursor = await db.execute("SELECT id FROM workflows WHERE id = ?", (workflow_id,))
-        if not await cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Workflow not found")
+    async with acquire_db(write=True) as db:
+        # usage references workflows, so it goes first; an unknown id simply
+        # deletes nothing and acquire_db rolls the open transaction back
         await db.execute("DELETE FROM usage WHERE workflow_id = ?", (workflow_id,))
-        await db.execute("DELETE FROM workflows WHERE id = ?", (workflow_id,))
+        cursor = await db.execute("DELETE FROM workflows WHERE id = ?", (workflow_id,))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Workflow not found")
         await db.commit()
-    finally:
-        await db.close()
+    _workflow_cache.pop(workflow_id, None)
     return {"message": "Workflow deleted"}
@@ -4,129 +4,348 @@ Supports section-based chunking for full-paper processing.
 """
 
 import os
+import re
 import json
-from openai import AzureOpenAI
+import logging
+import time
+import pybase64
+import asyncio
+import hashlib
+from functools import lru_cache
+import httpx
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncAzureOpenAI,
+    DefaultAsyncHttpxClient,
+    InternalServerError,
+    RateLimitError,
+)
 from dotenv import load_dotenv
 
+from app.utils.json_safe import safe_parse_json
+from app.services.vision_cache import cache_key, get_descriptions, save_descriptions
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
 API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
 DEPLOYMENT = os.getenv("AZURE_OPENAI_MODEL_DEPLOYMENT", "")
 API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
 MAX_CHUNK_CHARS = int(os.getenv("MAX_CHUNK_CHARS", "30000"))
 
-
-def get_client() -> AzureOpenAI:
-    return AzureOpenAI(
-        azure_endpoint=ENDPOINT,
-        api_key=API_KEY,
+# Retries on 429 / 5xx / timeouts / connection errors are done by the SDK
+# itself: jittered exponential backoff that honours Retry-After
+MAX_RETRIES = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "6"))
+# Client-side ceiling on requests per minute to the deployment (0 = off)
+MAX_RPM = int(os.getenv("AZURE_OPENAI_MAX_RPM", "0"))
+# Optional second resource, tried once when the primary is still throttled /
+# unreachable after its retries (unset = no fallback)
+FALLBACK_ENDPOINT = os.getenv("AZURE_OPENAI_FALLBACK_ENDPOINT", "")
+FALLBACK_API_KEY = os.getenv("AZURE_OPENAI_FALLBACK_API_KEY") or API_KEY
+FALLBACK_DEPLOYMENT = os.getenv("AZURE_OPENAI_FALLBACK_DEPLOYMENT") or DEPLOYMENT
+
+# Max in-flight requests per fan-out (respect rate limits)
+FIGURE_CONCURRENCY = 6
+CHUNK_CONCURRENCY = 4
+FIGURE_BATCH_SIZE = int(os.getenv("FIGURE_BATCH_SIZE", "6"))  # images per vision request
+# Images smaller than this on both sides go to vision at "low" detail (fewer tokens)
+LOW_DETAIL_MAX_SIDE = 512
+# Keep-alive pool shared by every request in the process (several runs can
+# fan out at once)
+HTTP_MAX_CONNECTIONS = 32
+
+
+def _make_client(endpoint: str, api_key: str) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        azure_endpoint=endpoint,
+        api_key=api_key,
         api_version=API_VERSION,
+        max_retries=MAX_RETRIES,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            )
+        ),
     )
 
 
-# ─── Figure analysis via GPT-4o vision ───
+@lru_cache(maxsize=1)
+def get_async_client() -> AsyncAzureOpenAI:
+    return _make_client(ENDPOINT, API_KEY)
 
 
-async def describe_figures(figure_images: list[dict]) -> list[dict]:
-    """Send all figure images to GPT-4o vision in parallel."""
-    import asyncio
+@lru_cache(maxsize=1)
+def _get_fallback_client() -> AsyncAzureOpenAI | None:
+    return _make_client(FALLBACK_ENDPOINT, FALLBACK_API_KEY) if FALLBACK_ENDPOINT else None
 
-    if not figure_images:
-        return []
 
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _describe_figures_parallel, figure_images)
+class _TokenBucket:
+    """Allows bursts of up to `per_minute` requests, refilled continuously."""
 
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_rate_limiter = _TokenBucket(MAX_RPM) if MAX_RPM > 0 else None
 
-def _describe_single_figure(client: "AzureOpenAI", fig: dict) -> dict | None:
-    """Describe one figure with GPT-4o vision. Returns dict or None if not a figure."""
-    caption = fig.get("caption", "")
-    b64 = fig.get("image_base64", "")
-    if not b64:
-        return None
 
+async def chat_completion(client: AsyncAzureOpenAI, **kwargs):
+    """
+    chat.completions.create, paced by AZURE_OPENAI_MAX_RPM when set.
+    If the call still fails with a throttling / availability error after the
+    SDK's retries and a fallback resource is configured, it is sent there
+    once instead of failing the whole step.
+    """
+    if _rate_limiter is not None:
+        await _rate_limiter.acquire()
     try:
-        response = client.chat.completions.create(
-            model=DEPLOYMENT,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a biomedical research assistant. Describe the figure/diagram/graph in detail. Include all data points, labels, axes, relationships, and conclusions that can be drawn. Be precise with numbers and terminology. If the image is not a scientific figure (e.g. it is an icon, logo, geometric shape, or decorative element with no data or labels), say exactly: 'NOT_A_FIGURE'.",
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"Describe this figure from a scientific paper in detail.{f' Caption: {caption}' if caption else ''}",
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{b64}",
-                                "detail": "high",
-                            },
-                        },
-                    ],
-                },
-            ],
-            temperature=0.2,
-            max_tokens=1000,
+        return await client.chat.completions.create(**kwargs)
+    except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+        fallback = _get_fallback_client()
+        if fallback is None or client is fallback:
+            raise
+        logger.warning("Azure OpenAI call failed (%s), retrying on fallback endpoint", type(e).__name__)
+        return await fallback.chat.completions.create(**{**kwargs, "model": FALLBACK_DEPLOYMENT})
+
+
+# ─── Figure analysis via GPT-4o vision ───
+
+VISION_SYSTEM_PROMPT = "You are a biomedical research assistant. Describe the figure/diagram/graph in detail. Include all data points, labels, axes, relationships, and conclusions that can be drawn. Be precise with numbers and terminology. If the image is not a scientific figure (e.g. it is an icon, logo, geometric shape, or decorative element with no data or labels), say exactly: 'NOT_A_FIGURE'."
+
+VISION_BATCH_INSTRUCTIONS = """You will be given {count} figures from a scientific paper, each preceded by its figure index.
+Describe every figure in detail, independently of the others.
+Return JSON only, in this exact shape:
+{{"figures": [{{"index": <figure index>, "description": "<detailed description>", "not_a_figure": <true|false>}}]}}
+Set not_a_figure to true (with an empty description) for images that are not scientific figures."""
+
+
+async def describe_figures(figure_images: list[dict]) -> list[dict]:
+    """Send all figure images to GPT-4o vision concurrently (cached by content)."""
+    if not figure_images:
+        return []
+
+    client = get_async_client()
+    semaphore = asyncio.Semaphore(FIGURE_CONCURRENCY)
+    start = time.time()
+
+    figure_images = [fig for fig in figure_images if fig.get("image_bytes")]
+    keys = [
+        cache_key(
+            fig.get("sha256") or hashlib.sha256(fig["image_bytes"]).hexdigest(),
+            fig.get("caption", ""),
+            DEPLOYMENT,
+            VISION_SYSTEM_PROMPT,
         )
-        description = response.choices[0].message.content or ""
+        for fig in figure_images
+    ]
+    cached = await get_descriptions(keys)
+    fresh: dict[str, str] = {}
+    failed: dict[str, str] = {}
+
+    async def _describe_one(fig: dict, key: str) -> None:
+        try:
+            async with semaphore:
+                fresh[key] = await _describe_single_figure(client, fig)
+        except Exception as e:
+            logger.warning("⚠️ Failed to describe figure %s: %s", fig["index"], e)
+            failed[key] = f"[Figure analysis failed: {str(e)}]"
+
+    async def _describe_batch(batch: list[tuple[dict, str]]) -> None:
+        # One request for several images; anything the model leaves out (or
+        # a malformed reply) falls back to a per-image call
+        descriptions = {}
+        if len(batch) > 1:
+            try:
+                async with semaphore:
+                    descriptions = await _describe_figure_batch(client, [fig for fig, _ in batch])
+            except Exception as e:
+                logger.warning("⚠️ Batched vision call failed, describing figures one by one: %s", e)
+        missing = []
+        for fig, key in batch:
+            if fig["index"] in descriptions:
+                fresh[key] = descriptions[fig["index"]]
+            else:
+                missing.append(_describe_one(fig, key))
+        await asyncio.gather(*missing)
+
+    misses = [(fig, key) for fig, key in zip(figure_images, keys) if key not in cached]
+    await asyncio.gather(*(
+        _describe_batch(misses[i : i + FIGURE_BATCH_SIZE])
+        for i in range(0, len(misses), FIGURE_BATCH_SIZE)
+    ))
+    await save_descriptions(fresh)
 
-        if "NOT_A_FIGURE" in description:
-            print(f"  ⏭️  Skipping figure {fig['index']} (page {fig['page']}): GPT-4o says not a figure")
-            return None
-
-        print(f"  🖼️  Described figure {fig['index']} (page {fig['page']})")
-        return {
-            "index": fig["index"],
-            "page": fig["page"],
-            "caption": caption,
-            "description": description,
-        }
-    except Exception as e:
-        print(f"  ⚠️ Failed to describe figure {fig['index']}: {e}")
-        return {
-            "index": fig["index"],
-            "page": fig["page"],
-            "caption": caption,
-            "description": f"[Figure analysis failed: {str(e)}]",
-        }
-
-
-def _describe_figures_parallel(figure_images: list[dict]) -> list[dict]:
-    """Describe all figures in parallel using a thread pool."""
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    import time
-
-    client = get_client()
     results = []
-    start = time.time()
+    for fig, key in zip(figure_images, keys):
+        description = cached[key] if key in cached else fresh.get(key, failed.get(key, ""))
+        if "NOT_A_FIGURE" in description:
+            logger.debug("⏭️  Skipping figure %s (page %s): GPT-4o says not a figure", fig["index"], fig["page"])
+            continue
+        results.append(_figure_result(fig, description))
 
-    # Run all vision calls in parallel (max 6 concurrent to respect rate limits)
-    with ThreadPoolExecutor(max_workers=6) as executor:
-        futures = {
-            executor.submit(_describe_single_figure, client, fig): fig["index"]
-            for fig in figure_images
-        }
-        for future in as_completed(futures):
-            result = future.result()
-            if result is not None:
-                results.append(result)
-
-    # Sort by index to maintain order
-    results.sort(key=lambda r: r["index"])
     elapsed = time.time() - start
-    print(f"  ⚡ {len(results)} figures described in {elapsed:.1f}s (parallel)")
+    logger.info(f"⚡ {len(results)} figures described in {elapsed:.1f}s "
+                f"({len(cached)} from cache, {len(fresh)} via vision)")
     return results
 
 
+def _image_url(fig: dict) -> dict:
+    """Vision image_url part: data URL in the figure's own format, low detail for small images."""
+    b64 = pybase64.b64encode(fig["image_bytes"]).decode("ascii")
+    mime_type = fig.get("mime_type", "image/png")
+    small = max(fig.get("width", 0), fig.get("height", 0)) < LOW_DETAIL_MAX_SIDE
+    return {
+        "url": f"data:{mime_type};base64,{b64}",
+        "detail": "low" if small and fig.get("width") else "high",
+    }
+
+
+def _figure_result(fig: dict, description: str) -> dict:
+    return {
+        "index": fig["index"],
+        "page": fig["page"],
+        "caption": fig.get("caption", ""),
+        "description": description,
+    }
+
+
+async def _describe_single_figure(client: AsyncAzureOpenAI, fig: dict) -> str:
+    """Raw GPT-4o vision description of one figure ('NOT_A_FIGURE' if it isn't one)."""
+    caption = fig.get("caption", "")
+
+    response = await chat_completion(
+        client,
+        model=DEPLOYMENT,
+        messages=[
+            {"role": "system", "content": VISION_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"Describe this figure from a scientific paper in detail.{f' Caption: {caption}' if caption else ''}",
+                    },
+                    {"type": "image_url", "image_url": _image_url(fig)},
+                ],
+            },
+        ],
+        temperature=0.2,
+        max_tokens=1000,
+    )
+    return response.choices[0].message.content or ""
+
+
+async def _describe_figure_batch(client: AsyncAzureOpenAI, figs: list[dict]) -> dict[int, str]:
+    """Describe several figures in one vision request. Returns {index: description}."""
+    content = [{"type": "text", "text": VISION_BATCH_INSTRUCTIONS.format(count=len(figs))}]
+    for fig in figs:
+        caption = fig.get("caption", "")
+        content.append({
+            "type": "text",
+            "text": f"Figure index {fig['index']}.{f' Caption: {caption}' if caption else ''}",
+        })
+        content.append({"type": "image_url", "image_url": _image_url(fig)})
+
+    response = await chat_completion(
+        client,
+        model=DEPLOYMENT,
+        messages=[
+            {"role": "system", "content": VISION_SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ],
+        temperature=0.2,
+        max_tokens=1000 * len(figs),
+        response_format={"type": "json_object"},
+    )
+
+    parsed = safe_parse_json(response.choices[0].message.content or "")
+    wanted = {fig["index"] for fig in figs}
+    descriptions = {}
+    for item in (parsed or {}).get("figures", []):
+        if not isinstance(item, dict) or item.get("index") not in wanted:
+            continue
+        if item.get("not_a_figure"):
+            descriptions[item["index"]] = "NOT_A_FIGURE"
+        elif item.get("description"):
+            descriptions[item["index"]] = item["description"]
+    return descriptions
+
+
 # ─── Figure-to-paper matching ───
 
-import re
+_FIG_REF_RE = re.compile(r'(?:Fig\.?\s*|Figure\s*)(\d+)\s*[.:\s]([^\n]{0,200})', re.IGNORECASE)
+_WORD_RE = re.compile(r'\b\w{4,}\b')
+
+
+# Extra score when a keyword appears in both the vision description and the caption
+_FIGURE_KEYWORD_BONUSES = {
+    "prisma": 2.0, "flowchart": 1.5, "flow diagram": 1.5,
+    "forest plot": 1.5, "funnel plot": 1.0,
+    "overall survival": 2.0, "progression": 2.0,
+    "toxicit": 2.0, "hematolog": 2.0,
+    "bias": 2.0, "cochrane": 1.5, "risk of bias": 2.0,
+}
+
+
+def _match_score_matrix(images: list[dict], refs: list[dict], ref_pages):
+    """
+    (I, R) array scoring how well each image matches each figure reference
+    (higher = better): page proximity + shared caption terms + keyword bonuses,
+    computed with whole-matrix NumPy ops instead of per-pair Python.
+    ref_pages holds each ref's estimated page, aligned with refs.
+    """
+
+    desc_lower = [img.get("description", "").lower() for img in images]
+    caption_lower = [ref.get("caption", "").lower() for ref in refs]
+
+    # Page proximity: same page = 3.0, 1 page away = 1.5, 2+ = 0.1
+    page_dist = np.abs(np.array([img["page"] for img in images])[:, None] - ref_pages[None, :])
+    scores = np.where(page_dist == 0, 3.0, np.where(page_dist == 1, 1.5, 0.1))
+
+    # Content similarity: 0.5 per distinct 4+ letter term shared with the caption.
+    # Term presence as 0/1 rows over a shared vocabulary → overlap via matmul.
+    desc_terms = [set(_WORD_RE.findall(t)) for t in desc_lower]
+    caption_terms = [set(_WORD_RE.findall(t)) for t in caption_lower]
+    vocab = {term: k for k, term in enumerate(set().union(*desc_terms, *caption_terms))}
+    if vocab:
+        desc_mask = np.zeros((len(images), len(vocab)), dtype=np.float32)
+        caption_mask = np.zeros((len(refs), len(vocab)), dtype=np.float32)
+        for i, terms in enumerate(desc_terms):
+            desc_mask[i, [vocab[t] for t in terms]] = 1
+        for j, terms in enumerate(caption_terms):
+            caption_mask[j, [vocab[t] for t in terms]] = 1
+        scores += 0.5 * (desc_mask @ caption_mask.T)
+
+    # Keyword bonus when both sides mention it
+    bonuses = np.array(list(_FIGURE_KEYWORD_BONUSES.values()))
+    desc_kw = np.array([[kw in t for kw in _FIGURE_KEYWORD_BONUSES] for t in desc_lower], dtype=np.float64)
+    caption_kw = np.array([[kw in t for kw in _FIGURE_KEYWORD_BONUSES] for t in caption_lower], dtype=np.float64)
+    scores += (desc_kw * bonuses) @ caption_kw.T
+
+    return scores
+
 
 def _match_figures_to_paper(text: str, figure_descriptions: list[dict]) -> list[dict]:
     """
@@ -139,10 +358,7 @@ def _match_figures_to_paper(text: str, figure_descriptions: list[dict]) -> list[
 
     # Find all figure references in text with their character offset and caption
     fig_refs = []
-    for m in re.finditer(
-        r'(?:Fig\.?\s*|Figure\s*)(\d+)\s*[.:\s]([^\n]{0,200})',
-        text, re.IGNORECASE
-    ):
+    for m in _FIG_REF_RE.finditer(text):
         fig_num = int(m.group(1))
         caption_snippet = m.group(2).strip()
         offset = m.start()
@@ -186,78 +402,27 @@ def _match_figures_to_paper(text: str, figure_descriptions: list[dict]) -> list[
                 "page": img["page"],
                 "description": img["description"],
             })
-            print(f"  🔗 Matched image (page {img['page']}) → {label} "
-                  f"(caption: {ref['caption'][:50]})")
+            logger.debug("🔗 Matched image (page %s) → %s (caption: %s)", img["page"], label, ref["caption"][:50])
         return matched
 
-    # Counts differ → use greedy content-similarity matching
-    print(f"  ⚠️  Image count ({len(sorted_images)}) ≠ figure refs ({len(sorted_refs)}), "
-          f"using content-similarity matching")
+    # Counts differ → use content-similarity matching
+    logger.info(f"⚠️  Image count ({len(sorted_images)}) ≠ figure refs ({len(sorted_refs)}), "
+                f"using content-similarity matching")
 
     # Estimate page for each figure reference using character offset ratio
+    # (float64 + round-half-even, as Python's round does)
     total_len = max(len(text), 1)
     max_page = max(fd["page"] for fd in figure_descriptions) if figure_descriptions else 8
-    for ref in unique_refs:
-        ref["est_page"] = max(1, round((ref["offset"] / total_len) * max_page))
-
-    def _match_score(img: dict, ref: dict) -> float:
-        """Score how well an image matches a figure reference. Higher = better."""
-        score = 0.0
-
-        # Page proximity: 0 distance = 1.0, 1 page away = 0.5, 2+ = 0.1
-        page_dist = abs(img["page"] - ref["est_page"])
-        if page_dist == 0:
-            score += 3.0
-        elif page_dist == 1:
-            score += 1.5
-        else:
-            score += 0.1
-
-        # Content similarity: compare GPT-4o description vs paper caption
-        desc_lower = img.get("description", "").lower()
-        caption_lower = ref.get("caption", "").lower()
-
-        # Extract key terms from caption for matching
-        caption_terms = set(re.findall(r'\b\w{4,}\b', caption_lower))
-        desc_terms = set(re.findall(r'\b\w{4,}\b', desc_lower))
-        if caption_terms:
-            overlap = len(caption_terms & desc_terms)
-            score += overlap * 0.5
-
-        # Bonus for specific matches
-        specific_keywords = {
-            "prisma": 2.0, "flowchart": 1.5, "flow diagram": 1.5,
-            "forest plot": 1.5, "funnel plot": 1.0,
-            "overall survival": 2.0, "progression": 2.0,
-            "toxicit": 2.0, "hematolog": 2.0,
-            "bias": 2.0, "cochrane": 1.5, "risk of bias": 2.0,
-        }
-        for keyword, bonus in specific_keywords.items():
-            if keyword in caption_lower and keyword in desc_lower:
-                score += bonus
-
-        return score
-
-    # Greedy best-match assignment: for each image, find best unmatched ref
-    matched = []
-    used_refs = set()
-    used_images = set()
-
-    # Build score matrix
-    scores = []
-    for i, img in enumerate(sorted_images):
-        for j, ref in enumerate(sorted_refs):
-            scores.append((i, j, _match_score(img, ref)))
+    offsets = np.fromiter((ref["offset"] for ref in sorted_refs), dtype=np.float64, count=len(sorted_refs))
+    ref_pages = np.maximum(1, np.round(offsets / total_len * max_page)).astype(np.int64)
 
-    # Sort by score descending, greedily assign best pairs
-    scores.sort(key=lambda x: -x[2])
+    scores = _match_score_matrix(sorted_images, sorted_refs, ref_pages)
 
-    assignments = {}  # image_idx -> ref_idx
-    for i, j, score in scores:
-        if i not in used_images and j not in used_refs:
-            assignments[i] = j
-            used_images.add(i)
-            used_refs.add(j)
+    # Optimal 1:1 assignment (Hungarian) over the image × ref score matrix;
+    # rectangular matrices leave the surplus images/refs unmatched
+    matched = []
+    row_ind, col_ind = linear_sum_assignment(scores, maximize=True)
+    assignments = dict(zip(row_ind.tolist(), col_ind.tolist()))  # image_idx -> ref_idx
 
     # Build result in image order
     for i, img in enumerate(sorted_images):
@@ -269,14 +434,14 @@ def _match_figures_to_paper(text: str, figure_descriptions: list[dict]) -> list[
                 "page": img["page"],
                 "description": img["description"],
             })
-            print(f"  🔗 Matched image (page {img['page']}) → {label} (caption: {ref['caption'][:50]})")
+            logger.debug("🔗 Matched image (page %s) → %s (caption: %s)", img["page"], label, ref["caption"][:50])
         else:
             matched.append({
                 "label": f"Image from Page {img['page']}",
                 "page": img["page"],
                 "description": img["description"],
             })
-            print(f"  ❓ Unmatched image (page {img['page']})")
+            logger.debug("❓ Unmatched image (page %s)", img["page"])
 
     return matched
 
@@ -288,7 +453,22 @@ def split_into_sections(text: str, sections: list[dict]) -> list[dict]:
     """
     Split text by section headings from Document Intelligence.
     Returns list of {heading, content} chunks.
+
+    Memoized on (text, headings): re-running a document reuses its chunks.
     """
+    section_key = tuple((s.get("offset"), s.get("heading")) for s in sections or ())
+    return [dict(chunk) for chunk in _split_cached(text, section_key)]
+
+
+@lru_cache(maxsize=32)
+def _split_cached(text: str, section_key: tuple) -> tuple[dict, ...]:
+    # Chunks come back as a tuple so a cached result can't be extended;
+    # split_into_sections hands out fresh dicts
+    sections = [{"offset": offset, "heading": heading} for offset, heading in section_key]
+    return tuple(_split_sections(text, sections))
+
+
+def _split_sections(text: str, sections: list[dict]) -> list[dict]:
     if not sections or len(sections) < 2:
         # No section info → chunk by character limit
         return _chunk_by_size(text)
@@ -340,23 +520,29 @@ def _merge_small_chunks(chunks: list[dict], max_size: int) -> list[dict]:
     """Merge consecutive small chunks to reduce LLM calls."""
     merged = []
     buffer_heading = ""
-    buffer_content = ""
+    # Buffer kept as parts + running length (the joined text's length,
+    # including "\n\n" separators) and only joined when flushed
+    buffer_parts: list[str] = []
+    buffer_len = 0
 
     for chunk in chunks:
-        if len(buffer_content) + len(chunk["content"]) < max_size:
+        content = chunk["content"]
+        if buffer_len + len(content) < max_size:
             if buffer_heading:
                 buffer_heading += " + " + chunk["heading"]
             else:
                 buffer_heading = chunk["heading"]
-            buffer_content += "\n\n" + chunk["content"]
+            buffer_parts.append(content)
+            buffer_len += 2 + len(content)
         else:
-            if buffer_content:
-                merged.append({"heading": buffer_heading, "content": buffer_content.strip()})
+            if buffer_len:
+                merged.append({"heading": buffer_heading, "content": "\n\n".join(buffer_parts).strip()})
             buffer_heading = chunk["heading"]
-            buffer_content = chunk["content"]
+            buffer_parts = [content]
+            buffer_len = len(content)
 
-    if buffer_content:
-        merged.append({"heading": buffer_heading, "content": buffer_content.strip()})
+    if buffer_len:
+        merged.append({"heading": buffer_heading, "content": "\n\n".join(buffer_parts).strip()})
 
     return merged
 
@@ -364,12 +550,18 @@ def _merge_small_chunks(chunks: list[dict], max_size: int) -> list[dict]:
 # ─── Main generation with chunking + synthesis ───
 
 
+def prepare_prompt(prompt_template: str, schema_json: str) -> str:
+    """Substitute the (static) schema once; only {text} is left for each chunk."""
+    return prompt_template.replace("{schema_json}", schema_json)
+
+
 async def generate_structured_output(
     prompt_template: str,
     schema_json: str,
     text: str,
     sections: list[dict] | None = None,
     figure_descriptions: list[dict] | None = None,
+    prepared_prompt: str | None = None,
 ) -> dict:
     """
     Process full paper text through section-based chunking:
@@ -377,18 +569,20 @@ async def generate_structured_output(
     2. Split into sections
     3. Process each chunk with LLM
     4. Synthesize final output
+
+    prepared_prompt is prompt_template with the schema already substituted
+    (see prepare_prompt); it is built here when the caller has none cached.
     """
-    import asyncio
+    if prepared_prompt is None:
+        prepared_prompt = prepare_prompt(prompt_template, schema_json)
 
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(
-        None, _generate_with_chunking, prompt_template, schema_json, text,
-        sections or [], figure_descriptions or []
+    return await _generate_with_chunking(
+        prepared_prompt, schema_json, text, sections or [], figure_descriptions or []
     )
 
 
-def _generate_with_chunking(
-    prompt_template: str,
+async def _generate_with_chunking(
+    prepared_prompt: str,
     schema_json: str,
     text: str,
     sections: list[dict],
@@ -409,70 +603,60 @@ def _generate_with_chunking(
 
     # Split into chunks
     chunks = split_into_sections(enriched_text, sections)
-    print(f"📊 Processing {len(chunks)} section chunk(s)")
+    logger.info(f"📊 Processing {len(chunks)} section chunk(s)")
 
-    client = get_client()
+    client = get_async_client()
 
     if len(chunks) == 1:
         # Single chunk → direct processing (no synthesis needed)
-        result = _process_single_chunk(
-            client, prompt_template, schema_json, chunks[0]["content"]
-        )
+        result = await _process_single_chunk(client, prepared_prompt, chunks[0]["content"])
         return result
 
-    # Multiple chunks → process each in parallel, then synthesize
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    import time
-
-    chunk_outputs = []
+    # Multiple chunks → process each concurrently, then synthesize
     start = time.time()
-    print(f"  📄 Processing {len(chunks)} chunks in parallel...")
-
-    def _process_chunk_wrapper(i, chunk):
-        print(f"  📄 Chunk {i+1}/{len(chunks)}: {chunk['heading'][:50]}...")
-        return i, _process_single_chunk(
-            client, prompt_template, schema_json, chunk["content"],
-            chunk_context=f"This is section '{chunk['heading']}' (part {i+1} of {len(chunks)} from the full paper)."
-        )
+    logger.info(f"📄 Processing {len(chunks)} chunks in parallel...")
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+
+    async def _process_chunk_bounded(i: int, chunk: dict) -> dict:
+        async with semaphore:
+            logger.debug("📄 Chunk %d/%d: %s...", i + 1, len(chunks), chunk["heading"][:50])
+            return await _process_single_chunk(
+                client, prepared_prompt, chunk["content"],
+                chunk_context=f"This is section '{chunk['heading']}' (part {i+1} of {len(chunks)} from the full paper)."
+            )
+
+    chunk_results = await asyncio.gather(
+        *(_process_chunk_bounded(i, chunk) for i, chunk in enumerate(chunks))
+    )
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(_process_chunk_wrapper, i, chunk) for i, chunk in enumerate(chunks)]
-        for future in as_completed(futures):
-            i, chunk_result = future.result()
-            if chunk_result["parsed"]:
-                chunk_outputs.append({
-                    "section": chunks[i]["heading"],
-                    "output": chunk_result["parsed"],
-                })
-
-    # Sort by original chunk order
-    chunk_outputs.sort(key=lambda c: next(
-        (i for i, ch in enumerate(chunks) if ch["heading"] == c["section"]), 0
-    ))
+    # gather keeps the original chunk order
+    chunk_outputs = [
+        {"section": chunk["heading"], "output": chunk_result["parsed"]}
+        for chunk, chunk_result in zip(chunks, chunk_results)
+        if chunk_result["parsed"]
+    ]
     elapsed = time.time() - start
-    print(f"  ⚡ {len(chunk_outputs)} chunks processed in {elapsed:.1f}s (parallel)")
+    logger.info(f"⚡ {len(chunk_outputs)} chunks processed in {elapsed:.1f}s (parallel)")
 
     # Synthesize all chunk outputs into final result
-    print(f"  🔄 Synthesizing {len(chunk_outputs)} chunk outputs...")
-    final = _synthesize_outputs(client, schema_json, chunk_outputs)
+    logger.info(f"🔄 Synthesizing {len(chunk_outputs)} chunk outputs...")
+    final = await _synthesize_outputs(client, schema_json, chunk_outputs)
     return final
 
 
-def _process_single_chunk(
-    client: AzureOpenAI,
-    prompt_template: str,
-    schema_json: str,
+async def _process_single_chunk(
+    client: AsyncAzureOpenAI,
+    prepared_prompt: str,
     text: str,
     chunk_context: str = "",
 ) -> dict:
     """Process a single text chunk through the LLM."""
-    user_message = prompt_template.replace("{schema_json}", schema_json).replace(
-        "{text}", text
-    )
+    user_message = prepared_prompt.replace("{text}", text)
     if chunk_context:
         user_message = chunk_context + "\n\n" + user_message
 
-    response = client.chat.completions.create(
+    response = await chat_completion(
+        client,
         model=DEPLOYMENT,
         messages=[
             {
@@ -487,14 +671,13 @@ def _process_single_chunk(
     )
 
     raw = response.choices[0].message.content or ""
-    from app.utils.json_safe import safe_parse_json
     parsed = safe_parse_json(raw)
 
     return {"parsed": parsed, "raw": raw}
 
 
-def _synthesize_outputs(
-    client: AzureOpenAI,
+async def _synthesize_outputs(
+    client: AsyncAzureOpenAI,
     schema_json: str,
     chunk_outputs: list[dict],
 ) -> dict:
@@ -518,7 +701,8 @@ SCHEMA:
 PARTIAL ANALYSES:
 {json.dumps(chunk_outputs, indent=2)}"""
 
-    response = client.chat.completions.create(
+    response = await chat_completion(
+        client,
         model=DEPLOYMENT,
         messages=[
             {
@@ -533,7 +717,6 @@ PARTIAL ANALYSES:
     )
 
     raw = response.choices[0].message.content or ""
-    from app.utils.json_safe import safe_parse_json
     parsed = safe_parse_json(raw)
 
     return {"parsed": parsed, "raw": raw}
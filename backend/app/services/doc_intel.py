@@ -6,45 +6,91 @@ Saves original content + span data for enriched .md generation after AI run.
 """
 
 import os
-import base64
 import re
+import asyncio
+import logging
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from typing import BinaryIO
+import fitz
 from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 ENDPOINT = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT", "")
 KEY = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_KEY", "")
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
-
 # ── Image extraction thresholds ──
 MIN_IMAGE_WIDTH = 50    # pixels – skip tiny bullets/dots only
 MIN_IMAGE_HEIGHT = 50   # pixels – skip tiny bullets/dots only
 MIN_IMAGE_BYTES = 2_000  # raw image bytes – skip decorative elements
 MAX_ASPECT_RATIO = 12   # skip extremely thin bars/lines (width/height or height/width)
+JPEG_QUALITY = 85       # re-encode quality for non-PNG/JPEG embedded images
+MAX_IMAGE_SIDE = 1536   # pixels – downscale larger images (GPT-4o high-detail cap)
+
+# ── Parallel image extraction ──
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = 4  # shorter PDFs are extracted inline (no IPC overhead)
 
+# Blank-line collapse after figure blanking, in one pass: a whitespace run with
+# 3+ newlines, or two newlines with only spaces/tabs between, becomes "\n\n".
+# The 3+ branch must come first so it claims the whole run.
+_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*\n+|\n[ \t]+\n")
 
+
+@lru_cache(maxsize=1)
 def get_client() -> DocumentIntelligenceClient:
+    # One client per process so its HTTP connection pool is reused across parses
     return DocumentIntelligenceClient(
         endpoint=ENDPOINT, credential=AzureKeyCredential(KEY)
     )
 
 
-async def parse_pdf(file_bytes: bytes, filename: str = "document.pdf") -> dict:
-    import asyncio
+async def parse_pdf(file: BinaryIO, filename: str = "document.pdf") -> dict:
+    """Parse a PDF from a binary file object (e.g. the spooled upload)."""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _parse_sync, file_bytes, filename)
-
-
-def _parse_sync(file_bytes: bytes, filename: str) -> dict:
+    return await loop.run_in_executor(None, _parse_sync, file, filename)
+
+
+def _blank_spans(text: str, spans: list[dict]) -> str:
+    """Replace every character covered by a span ({offset, length}) with a space."""
+    # Sort + merge overlapping spans, then copy the gaps between them as slices
+    merged: list[list[int]] = []
+    for start, end in sorted((s["offset"], s["offset"] + s["length"]) for s in spans):
+        start, end = min(start, len(text)), min(end, len(text))
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    parts = []
+    prev = 0
+    for start, end in merged:
+        parts.append(text[prev:start])
+        parts.append(" " * (end - start))
+        prev = end
+    parts.append(text[prev:])
+    return "".join(parts)
+
+
+def _parse_sync(file: BinaryIO, filename: str) -> dict:
     client = get_client()
+    file.seek(0)
     poller = client.begin_analyze_document(
         "prebuilt-layout",
-        analyze_request=file_bytes,
+        analyze_request=file,
         content_type="application/pdf",
+        # Span offsets/lengths in code points, i.e. plain Python str indices
+        # (the service default counts grapheme clusters)
+        string_index_type="unicodeCodePoint",
     )
     result = poller.result()
 
@@ -56,7 +102,6 @@ def _parse_sync(file_bytes: bytes, filename: str) -> dict:
 
     # ── 2) Collect DI figure spans (for OCR noise cleaning only) ──
     all_figure_span_data = []
-    figure_char_offsets = set()
     if hasattr(result, "figures") and result.figures:
         for i, fig in enumerate(result.figures):
             caption = ""
@@ -70,8 +115,6 @@ def _parse_sync(file_bytes: bytes, filename: str) -> dict:
                         "di_index": i,
                         "caption": caption,
                     })
-                    for off in range(span.offset, span.offset + span.length):
-                        figure_char_offsets.add(off)
 
     # ── 3) Collect ALL table spans (for enriched .md placement) ──
     all_table_span_data = []
@@ -86,13 +129,9 @@ def _parse_sync(file_bytes: bytes, filename: str) -> dict:
                     })
 
     # ── 4) Build cleaned text: strip figure OCR noise ──
-    if figure_char_offsets:
-        cleaned_chars = []
-        for i, ch in enumerate(original_content):
-            cleaned_chars.append(" " if i in figure_char_offsets else ch)
-        cleaned_text = "".join(cleaned_chars)
-        cleaned_text = re.sub(r"\n\s*\n\s*\n+", "\n\n", cleaned_text)
-        cleaned_text = re.sub(r"\n[ \t]+\n", "\n\n", cleaned_text)
+    if all_figure_span_data:
+        cleaned_text = _blank_spans(original_content, all_figure_span_data)
+        cleaned_text = _BLANK_LINES_RE.sub("\n\n", cleaned_text)
     else:
         cleaned_text = original_content
 
@@ -101,8 +140,9 @@ def _parse_sync(file_bytes: bytes, filename: str) -> dict:
     tables_md = []
     if result.tables:
         for i, tbl in enumerate(result.tables):
-            tables_html.append(_table_to_html(tbl, i + 1))
-            tables_md.append(_table_to_markdown(tbl, i + 1))
+            grid = _table_grid(tbl)
+            tables_html.append(_table_to_html(grid, i + 1))
+            tables_md.append(_table_to_markdown(grid, i + 1))
 
     # ── 6) Extract section headings for chunking ──
     sections = []
@@ -113,7 +153,9 @@ def _parse_sync(file_bytes: bytes, filename: str) -> dict:
                 sections.append({"heading": p.content, "offset": offset})
 
     # ── 7) Extract ALL images directly from PDF via PyMuPDF ──
-    figure_images = _extract_images_pymupdf(file_bytes)
+    # (PyMuPDF needs the whole PDF in memory; only materialise it here)
+    file.seek(0)
+    figure_images = _extract_images_pymupdf(file.read())
 
     # ── 8) Tag figure spans with kept_index (not used for image matching anymore) ──
     for fsd in all_figure_span_data:
@@ -146,119 +188,207 @@ def _extract_images_pymupdf(file_bytes: bytes) -> list[dict]:
     Completely independent of Document Intelligence.
     Filters out icons, logos, and decorative elements by size.
     Deduplicates by xref (same image referenced on multiple pages).
+
+    Listing xrefs is cheap; decoding/re-encoding them is the CPU-bound part,
+    so for longer PDFs that work is spread over a process pool.
     """
-    import fitz
     figure_images = []
-    seen_xrefs = set()
 
     try:
         pdf_doc = fitz.open(stream=file_bytes, filetype="pdf")
-        print(f"🖼️  PyMuPDF: scanning {len(pdf_doc)} pages for images...")
-
-        for page_num in range(len(pdf_doc)):
-            page = pdf_doc[page_num]
-            image_list = page.get_images(full=True)
-
-            for img_info in image_list:
-                xref = img_info[0]
-
-                # Skip duplicates (same image embedded once, referenced many times)
+        page_count = len(pdf_doc)
+        logger.info(f"🖼️  PyMuPDF: scanning {page_count} pages for images...")
+
+        # Unique xrefs in page order (same image embedded once, referenced many times)
+        # The listing already carries each image's Width/Height from its PDF
+        # dictionary, so icons/bars are dropped here without being decoded
+        items = []
+        seen_xrefs = set()
+        for page_num in range(page_count):
+            for img_info in pdf_doc[page_num].get_images(full=True):
+                xref, width, height = img_info[0], img_info[2], img_info[3]
                 if xref in seen_xrefs:
                     continue
                 seen_xrefs.add(xref)
+                skip = _size_skip_reason(width, height)
+                if skip:
+                    logger.debug("⏭️  Skip xref=%s page %s: %s", xref, page_num + 1, skip)
+                    continue
+                items.append((xref, page_num))
+
+        workers = min(IMAGE_WORKERS, len(items))
+        if page_count > PARALLEL_MIN_PAGES and workers > 1:
+            pdf_doc.close()
+            slices = [items[i::workers] for i in range(workers)]
+            extracted = {}
+            # Workers open the PDF from a temp file, so each task pickles a
+            # path instead of the whole document
+            with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+                tmp.write(file_bytes)
+                tmp.flush()
+                for part, results in zip(
+                    slices,
+                    _image_pool().map(_extract_images_worker, [(tmp.name, sl) for sl in slices]),
+                ):
+                    extracted.update(zip((xref for xref, _ in part), results))
+            candidates = [extracted[xref] for xref, _ in items]
+        else:
+            candidates = [_extract_one_image(pdf_doc, xref, page_num) for xref, page_num in items]
+            pdf_doc.close()
+
+        for fig in candidates:
+            if fig is None:
+                continue
+            idx = len(figure_images) + 1
+            figure_images.append({"index": idx, **fig})
+            logger.debug("✅ Image %d: page %s, %sx%s, %d bytes",
+                         idx, fig["page"], fig["width"], fig["height"], len(fig["image_bytes"]))
+
+        logger.info(f"🖼️  PyMuPDF: extracted {len(figure_images)} images total")
 
-                try:
-                    base_image = pdf_doc.extract_image(xref)
-                    if not base_image:
-                        continue
-
-                    img_bytes = base_image["image"]
-                    width = base_image.get("width", 0)
-                    height = base_image.get("height", 0)
-                    ext = base_image.get("ext", "png")
-
-                    # Filter: skip tiny images (icons, logos, bullets)
-                    if width < MIN_IMAGE_WIDTH or height < MIN_IMAGE_HEIGHT:
-                        print(f"  ⏭️  Skip xref={xref} page {page_num+1}: too small ({width}x{height})")
-                        continue
-
-                    if len(img_bytes) < MIN_IMAGE_BYTES:
-                        print(f"  ⏭️  Skip xref={xref} page {page_num+1}: too few bytes ({len(img_bytes)})")
-                        continue
-
-                    # Filter: skip extremely thin bars/lines/banners
-                    aspect = max(width, height) / max(min(width, height), 1)
-                    if aspect > MAX_ASPECT_RATIO:
-                        print(f"  ⏭️  Skip xref={xref} page {page_num+1}: extreme aspect ratio ({width}x{height}, ratio={aspect:.1f})")
-                        continue
-
-                    # Convert to PNG if needed for consistent format
-                    if ext != "png":
-                        try:
-                            pix = fitz.Pixmap(img_bytes)
-                            if pix.n > 4:  # CMYK → RGB
-                                pix = fitz.Pixmap(fitz.csRGB, pix)
-                            img_bytes = pix.tobytes("png")
-                        except Exception:
-                            # If conversion fails, use original bytes
-                            pass
-
-                    img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-                    idx = len(figure_images) + 1
-
-                    figure_images.append({
-                        "index": idx,
-                        "page": page_num + 1,
-                        "caption": "",  # PyMuPDF doesn't know captions
-                        "image_base64": img_b64,
-                        "width": width,
-                        "height": height,
-                    })
-                    print(f"  ✅ Image {idx}: page {page_num+1}, {width}x{height}, {len(img_bytes)} bytes")
+    except Exception as e:
+        logger.warning("⚠️ PyMuPDF image extraction error: %s", e)
 
-                except Exception as e:
-                    print(f"  ⚠️ Error extracting xref={xref}: {e}")
-                    continue
+    return figure_images
+
+
+@lru_cache(maxsize=1)
+def _image_pool() -> ProcessPoolExecutor:
+    # Long-lived so workers pay the fitz import once. "spawn" because the
+    # server process is multi-threaded, which makes fork unsafe.
+    return ProcessPoolExecutor(
+        max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
 
+
+def shutdown_image_pool() -> None:
+    """Stop the image-extraction workers, if any were started (app shutdown)."""
+    if _image_pool.cache_info().currsize:
+        _image_pool().shutdown(cancel_futures=True)
+        _image_pool.cache_clear()
+
+
+def _extract_images_worker(args: tuple[str, list[tuple[int, int]]]) -> list[dict | None]:
+    """Process-pool entry point: extract a slice of (xref, page_num) items from the PDF at path."""
+    path, items = args
+    pdf_doc = fitz.open(path, filetype="pdf")
+    try:
+        return [_extract_one_image(pdf_doc, xref, page_num) for xref, page_num in items]
+    finally:
         pdf_doc.close()
-        print(f"🖼️  PyMuPDF: extracted {len(figure_images)} images total")
 
-    except Exception as e:
-        print(f"⚠️ PyMuPDF image extraction error: {e}")
 
-    return figure_images
+def _size_skip_reason(width: int, height: int) -> str | None:
+    """Why an image of this size is not a figure, or None if it may be one."""
+    # Tiny images (icons, logos, bullets)
+    if width < MIN_IMAGE_WIDTH or height < MIN_IMAGE_HEIGHT:
+        return f"too small ({width}x{height})"
+    # Extremely thin bars/lines/banners
+    aspect = max(width, height) / max(min(width, height), 1)
+    if aspect > MAX_ASPECT_RATIO:
+        return f"extreme aspect ratio ({width}x{height}, ratio={aspect:.1f})"
+    return None
+
+
+def _extract_one_image(pdf_doc, xref: int, page_num: int) -> dict | None:
+    """Filter + normalise one embedded image; None if it is skipped (no index yet)."""
+    try:
+        base_image = pdf_doc.extract_image(xref)
+        if not base_image:
+            return None
+
+        img_bytes = base_image["image"]
+        width = base_image.get("width", 0)
+        height = base_image.get("height", 0)
+        ext = base_image.get("ext", "png")
+
+        # Re-checked on the decoded size in case the PDF dictionary lied
+        skip = _size_skip_reason(width, height)
+        if skip:
+            logger.debug("⏭️  Skip xref=%s page %s: %s", xref, page_num + 1, skip)
+            return None
+
+        if len(img_bytes) < MIN_IMAGE_BYTES:
+            logger.debug("⏭️  Skip xref=%s page %s: too few bytes (%d)", xref, page_num + 1, len(img_bytes))
+            return None
+
+        # Keep PNG and RGB/grey JPEG as embedded; re-encode anything
+        # else as JPEG (PNG only when there is alpha). JPEG encodes
+        # far faster and is several times smaller to upload to GPT-4o.
+        # Oversized images are downscaled first — vision tiles them
+        # at 512 px anyway, so extra resolution only costs bytes.
+        oversized = max(width, height) > MAX_IMAGE_SIDE
+        mime_type = "image/png"
+        if ext == "jpeg" and base_image.get("colorspace", 3) <= 3 and not oversized:
+            mime_type = "image/jpeg"
+        elif ext != "png" or oversized:
+            try:
+                pix = fitz.Pixmap(img_bytes)
+                if pix.n - pix.alpha > 3:  # CMYK → RGB
+                    pix = fitz.Pixmap(fitz.csRGB, pix)
+                if oversized:
+                    scale = MAX_IMAGE_SIDE / max(pix.width, pix.height)
+                    pix = fitz.Pixmap(
+                        pix,
+                        max(1, round(pix.width * scale)),
+                        max(1, round(pix.height * scale)),
+                    )
+                    width, height = pix.width, pix.height
+                if pix.alpha:
+                    img_bytes = pix.tobytes("png")
+                else:
+                    img_bytes = pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+                    mime_type = "image/jpeg"
+            except Exception:
+                # If conversion fails, use original bytes
+                pass
+
+        return {
+            "page": page_num + 1,
+            "caption": "",  # PyMuPDF doesn't know captions
+            "image_bytes": img_bytes,
+            "mime_type": mime_type,
+            # Content hash: keys the cross-document vision cache
+            "sha256": hashlib.sha256(img_bytes).hexdigest(),
+            "width": width,
+            "height": height,
+        }
+    except Exception as e:
+        logger.warning("⚠️ Error extracting xref=%s: %s", xref, e)
+        return None
 
 
-def _table_to_html(table, table_num: int) -> str:
+def _table_grid(table) -> list[list[str]]:
+    """rows × cols grid of single-line cell texts (shared by the HTML + markdown renderers)."""
     rows, cols = table.row_count, table.column_count
     grid = [["" for _ in range(cols)] for _ in range(rows)]
     for cell in table.cells:
         r, c = cell.row_index, cell.column_index
         if r < rows and c < cols:
             grid[r][c] = cell.content.replace("\n", " ").strip()
+    return grid
+
+
+def _table_to_html(grid: list[list[str]], table_num: int) -> str:
     lines = [f"<h4>Table {table_num}</h4>"]
     lines.append('<table border="1" cellpadding="6" cellspacing="0" style="border-collapse:collapse;">')
     for r_idx, row in enumerate(grid):
         lines.append("  <tr>")
-        tag = "th" if r_idx == 0 else "td"
-        for v in row:
-            lines.append(f"    <{tag}>{v or '&nbsp;'}</{tag}>")
+        if row:
+            # One join per row (one cell per line) instead of an f-string per cell
+            tag = "th" if r_idx == 0 else "td"
+            lines.append(
+                f"    <{tag}>" + f"</{tag}>\n    <{tag}>".join(v or "&nbsp;" for v in row) + f"</{tag}>"
+            )
         lines.append("  </tr>")
     lines.append("</table>")
     return "\n".join(lines)
 
 
-def _table_to_markdown(table, table_num: int) -> str:
-    rows, cols = table.row_count, table.column_count
-    grid = [["" for _ in range(cols)] for _ in range(rows)]
-    for cell in table.cells:
-        r, c = cell.row_index, cell.column_index
-        if r < rows and c < cols:
-            grid[r][c] = cell.content.replace("\n", " ").strip()
+def _table_to_markdown(grid: list[list[str]], table_num: int) -> str:
     lines = [f"### Table {table_num}"]
     for r_idx, row in enumerate(grid):
-        line = "| " + " | ".join(cell or " " for cell in row) + " |"
-        lines.append(line)
+        lines.append("| " + " | ".join(cell or " " for cell in row) + " |")
         if r_idx == 0:
-            lines.append("| " + " | ".join("---" for _ in row) + " |")
+            lines.append("| " + " | ".join(["---"] * len(row)) + " |")
     return "\n".join(lines)
@@ -16,7 +16,63 @@ import os
 import re
 from datetime import datetime
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+from app.utils.paths import RUNS_DIR
+
+# Runs of 4+ newlines left behind by removed regions collapse to 3
+_EXCESS_NEWLINES_RE = re.compile(r"\n{4,}")
+
+
+def _group_ranges(spans: list[dict], key: str) -> dict[int, list]:
+    """
+    {spans[i][key]: [min_offset, max_end, first_span]} in one pass.
+    Most groups have a single span, so ranges are reduced as spans arrive
+    rather than collecting a list per group first.
+    """
+    groups: dict[int, list] = {}
+    for span in spans:
+        offset = span["offset"]
+        end = offset + span["length"]
+        group = groups.get(span[key])
+        if group is None:
+            groups[span[key]] = [offset, end, span]
+        else:
+            if offset < group[0]:
+                group[0] = offset
+            if end > group[1]:
+                group[1] = end
+    return groups
+
+
+def _apply_replacements(original_content: str, replacements: list[tuple[int, int, str]]) -> str:
+    """Replace each accepted (offset, length, text) region of original_content."""
+    # Plain-text documents (no tables/figures) come back untouched, uncopied
+    if not replacements:
+        return original_content
+
+    # ── Sort ascending by offset and sweep: accept a region only if it starts
+    # at or after the end of the last accepted one (earliest start wins, so a
+    # table keeps its full range over a figure nested inside it) ──
+    replacements.sort(key=lambda r: r[0])
+
+    filtered: list[tuple[int, int, str]] = []
+    last_end = 0
+    for offset, length, text in replacements:
+        end = offset + length
+        if offset >= last_end and end <= len(original_content):
+            filtered.append((offset, length, text))
+            last_end = end
+        # else: overlaps an accepted region (or runs past the content) → skip
+
+    # ── Apply replacements ──
+    # Single forward pass: untouched slices + replacement texts, joined once
+    parts: list[str] = []
+    cursor = 0
+    for offset, length, text in filtered:
+        parts.append(original_content[cursor:offset])
+        parts.append(text)
+        cursor = offset + length
+    parts.append(original_content[cursor:])
+    return "".join(parts)
 
 
 def build_enriched_markdown(
@@ -33,44 +89,27 @@ def build_enriched_markdown(
     - Figures replaced with AI-generated descriptions (or a placeholder)
     """
     # ── Map figure descriptions by kept_index ──
-    fig_desc_by_kept = {}
-    for fd in figure_descriptions:
-        fig_desc_by_kept[fd["index"]] = fd
+    fig_desc_by_kept: dict[int, dict] = {fd["index"]: fd for fd in figure_descriptions}
 
     # ── Collect replacement regions ──
     # Each entry: (offset, length, replacement_text)
     replacements: list[tuple[int, int, str]] = []
 
-    # Tables: group spans by table_index, use the earliest offset
-    table_groups: dict[int, list[dict]] = {}
-    for ts in table_spans:
-        idx = ts["table_index"]
-        table_groups.setdefault(idx, []).append(ts)
-
-    for table_idx, spans in table_groups.items():
+    # Tables: group spans by table_index, use the full range covered by all
+    # spans of each table
+    for table_idx, (min_offset, max_end, _) in _group_ranges(table_spans, "table_index").items():
         if table_idx >= len(tables_html):
             continue
-        # Use the full range covered by all spans of this table
-        min_offset = min(s["offset"] for s in spans)
-        max_end = max(s["offset"] + s["length"] for s in spans)
-        total_length = max_end - min_offset
         html = tables_html[table_idx]
-        replacements.append((min_offset, total_length, f"\n\n{html}\n\n"))
+        replacements.append((min_offset, max_end - min_offset, f"\n\n{html}\n\n"))
 
     # Figures: group spans by di_index
-    figure_groups: dict[int, list[dict]] = {}
-    for fs in figure_spans:
-        di_idx = fs["di_index"]
-        figure_groups.setdefault(di_idx, []).append(fs)
-
-    for di_idx, spans in figure_groups.items():
-        min_offset = min(s["offset"] for s in spans)
-        max_end = max(s["offset"] + s["length"] for s in spans)
+    for min_offset, max_end, first_span in _group_ranges(figure_spans, "di_index").values():
         total_length = max_end - min_offset
 
         # Check if this figure was kept (sent to GPT-4o vision)
-        kept_index = spans[0].get("kept_index")
-        caption = spans[0].get("caption", "")
+        kept_index = first_span.get("kept_index")
+        caption = first_span.get("caption", "")
 
         if kept_index and kept_index in fig_desc_by_kept:
             desc = fig_desc_by_kept[kept_index]
@@ -95,29 +134,16 @@ def build_enriched_markdown(
             # Unknown small figure — just remove the OCR noise
             replacements.append((min_offset, total_length, "\n\n"))
 
-    # ── Sort descending by offset so replacements don't shift positions ──
-    replacements.sort(key=lambda r: r[0], reverse=True)
-
-    # ── Handle overlaps: if a later replacement overlaps an earlier one, skip it ──
-    filtered: list[tuple[int, int, str]] = []
-    occupied_until = len(original_content)  # track the start of the first accepted region
-    for offset, length, text in replacements:
-        end = offset + length
-        if end <= occupied_until:
-            filtered.append((offset, length, text))
-            occupied_until = offset
-        # else: this region overlaps with an already-accepted one → skip
-
-    # ── Apply replacements ──
-    enriched = original_content
-    for offset, length, text in filtered:
-        enriched = enriched[:offset] + text + enriched[offset + length:]
+    # ── Splice the accepted regions into the original text ──
+    enriched = _apply_replacements(original_content, replacements)
 
     # ── Clean up excessive whitespace left over ──
-    enriched = re.sub(r"\n{4,}", "\n\n\n", enriched)
+    # (the substring test skips the regex scan when there is nothing to collapse)
+    if "\n\n\n\n" in enriched:
+        enriched = _EXCESS_NEWLINES_RE.sub("\n\n\n", enriched)
 
     # ── Build final document ──
-    clean_name = filename.replace(".pdf", "").replace(".PDF", "")
+    clean_name = filename[:-4] if filename.lower().endswith(".pdf") else filename
     header = (
         f"# {clean_name}\n\n"
         f"_Enriched document — tables as HTML, figures described by AI_  \n"
@@ -130,10 +156,10 @@ def build_enriched_markdown(
 
 def save_enriched_markdown(content: str, run_id: str) -> str:
     """Save the enriched .md to data/runs/{run_id}_enriched.md and return the path."""
-    runs_dir = os.path.join(DATA_DIR, "runs")
-    os.makedirs(runs_dir, exist_ok=True)
-    path = os.path.join(runs_dir, f"{run_id}_enriched.md")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
+    path = os.path.join(RUNS_DIR, f"{run_id}_enriched.md")
+    # Encode once and hand the bytes straight to the file (no text-layer codec)
+    data = content.encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
     print(f"📄 Saved enriched .md: {path}")
     return path
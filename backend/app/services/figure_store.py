@@ -0,0 +1,140 @@
+"""
+Figure image storage on disk.
+
+Each document gets data/figures/{doc_id}/ with one raw image per figure
+({index}.jpg or {index}.png, per its mime_type) plus an index.json sidecar
+holding the non-image metadata (page, caption, width, height, mime_type,
+sha256). Images travel as raw bytes ("image_bytes") from extraction to disk
+and back; they are only base64-encoded at the GPT-4o vision call site.
+"""
+
+import os
+import logging
+import tempfile
+import threading
+import contextlib
+import pybase64
+import orjson
+from app.utils.paths import FIGURES_DIR
+
+logger = logging.getLogger(__name__)
+
+# Figures written before JPEG support have no mime_type and are PNG
+DEFAULT_MIME_TYPE = "image/png"
+_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png"}
+
+# Figure requests for one document arrive together (a browser loads them all
+# at once) on worker threads; one lock per doc lets a single thread migrate
+_migration_locks: dict[str, threading.Lock] = {}
+_migration_locks_guard = threading.Lock()
+
+
+def _doc_dir(doc_id: str) -> str:
+    return os.path.join(FIGURES_DIR, doc_id)
+
+
+def _index_path(doc_id: str) -> str:
+    return os.path.join(_doc_dir(doc_id), "index.json")
+
+
+def _image_path(doc_dir: str, fig: dict) -> str:
+    ext = _EXTENSIONS[fig.get("mime_type", DEFAULT_MIME_TYPE)]
+    return os.path.join(doc_dir, f"{fig['index']}{ext}")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write via a temp file + os.replace, so readers only ever see whole files."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def _find_image(doc_id: str, index: int) -> tuple[str, str, os.stat_result] | None:
+    # The probe's stat is the one returned, so serving a figure stats once per
+    # extension tried and never again
+    doc_dir = _doc_dir(doc_id)
+    for mime_type, ext in _EXTENSIONS.items():
+        path = os.path.join(doc_dir, f"{index}{ext}")
+        try:
+            return path, mime_type, os.stat(path)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def figure_path(doc_id: str, index: int) -> tuple[str, str, os.stat_result] | None:
+    """(path, mime_type, stat_result) of a 1-based figure index, or None if there is none."""
+    # Stats only the image itself; the legacy layout is checked on a miss
+    found = _find_image(doc_id, index)
+    if found is None:
+        _migrate_legacy(doc_id)
+        found = _find_image(doc_id, index)
+    return found
+
+
+def save_figures(doc_id: str, figure_images: list[dict]) -> None:
+    """Write parse_pdf's figure_images (raw image_bytes) as image files + index.json."""
+    doc_dir = _doc_dir(doc_id)
+    os.makedirs(doc_dir, exist_ok=True)
+
+    index = []
+    for fig in figure_images:
+        _write_atomic(_image_path(doc_dir, fig), fig["image_bytes"])
+        index.append({k: v for k, v in fig.items() if k != "image_bytes"})
+
+    # Published last: an index.json means every image it lists is in place
+    _write_atomic(_index_path(doc_id), orjson.dumps(index))
+
+
+def has_figures(doc_id: str) -> bool:
+    _migrate_legacy(doc_id)
+    return os.path.exists(_index_path(doc_id))
+
+
+def load_figure_images(doc_id: str) -> list[dict]:
+    """Rebuild the figure_images list (with image_bytes) for vision analysis."""
+    if not has_figures(doc_id):
+        return []
+
+    with open(_index_path(doc_id), "rb") as f:
+        index = orjson.loads(f.read())
+
+    doc_dir = _doc_dir(doc_id)
+    figure_images = []
+    for meta in index:
+        with open(_image_path(doc_dir, meta), "rb") as f:
+            figure_images.append({**meta, "image_bytes": f.read()})
+    return figure_images
+
+
+def _migrate_legacy(doc_id: str) -> None:
+    """Convert an old data/figures/{doc_id}.json (base64 blob) to the PNG layout."""
+    legacy_path = os.path.join(FIGURES_DIR, f"{doc_id}.json")
+    if os.path.exists(_index_path(doc_id)) or not os.path.exists(legacy_path):
+        return
+
+    with _migration_locks_guard:
+        lock = _migration_locks.setdefault(doc_id, threading.Lock())
+    with lock:
+        # Another thread may have finished the migration while this one waited
+        if os.path.exists(_index_path(doc_id)):
+            return
+        try:
+            with open(legacy_path, "rb") as f:
+                figure_images = orjson.loads(f.read())
+        except FileNotFoundError:  # migrated (and removed) by another process
+            return
+        for fig in figure_images:
+            fig["image_bytes"] = pybase64.b64decode(fig.pop("image_base64"))
+        save_figures(doc_id, figure_images)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(legacy_path)
+    with _migration_locks_guard:
+        _migration_locks.pop(doc_id, None)
+    logger.info(f"📦 Migrated {len(figure_images)} legacy figures for doc {doc_id[:8]}")
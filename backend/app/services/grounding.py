@@ -11,30 +11,172 @@ performs three layers of validation:
 """
 
 import re
-import json
+import asyncio
+import hashlib
 import os
-from difflib import SequenceMatcher
-from openai import AzureOpenAI
+import logging
+import orjson
+from collections import OrderedDict
+from functools import lru_cache
+import tiktoken
+from rapidfuzz import fuzz, process
 from dotenv import load_dotenv
 
+from app.services.aoai import chat_completion, get_async_client
+
 load_dotenv()
 
-ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
-API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
+logger = logging.getLogger(__name__)
+
 DEPLOYMENT = os.getenv("AZURE_OPENAI_MODEL_DEPLOYMENT", "")
-API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2025-01-01-preview")
 
 # ─── Thresholds ───
 QUOTE_SIMILARITY_THRESHOLD = 0.60  # fuzzy match ratio for quotes (lower = more lenient)
 STAT_MATCH_THRESHOLD = 0.50  # fraction of key values that must be found
+MAX_ANCHORS = 4  # word pairs of a quote looked up in the source
+MAX_ANCHOR_HITS = 8  # quote-anchor occurrences scored locally before a full-source scan
+LLM_CACHE_SIZE = 256  # judge / correction responses kept in memory
+RESULT_CACHE_SIZE = 256  # validate_grounding results kept in memory
+
+# ─── Source excerpt sent to the LLM (head + tail of the paper, in tokens) ───
+SOURCE_HEAD_TOKENS = 3750
+SOURCE_TAIL_TOKENS = 1250
+SOURCE_TOKENIZER = "o200k_base"  # GPT-4o family
+
+# ─── Statistic patterns (used by _extract_key_values) ───
+# Quantifiers are possessive (++ / *+): whatever follows a number run can't
+# start with a digit or dot, so giving characters back never helps and only
+# costs backtracking. Number-first patterns also start only at the beginning
+# of a run ((?<![\d.])) — a later start inside a run that failed fails the
+# same way — which keeps long digit/dot runs linear instead of quadratic.
+# [HRO]R is HR|RR|OR as one class, which the engine can scan for directly
+_METRIC_RE = re.compile(r"([HRO]R)\s*+(?:=|is|of|:)\s*+([\d.]++)", re.IGNORECASE)
+_P_VALUE_RE = re.compile(r"p\s*+([<>=]++)\s*+([\d.]++)", re.IGNORECASE)
+_CI_RE = re.compile(r"CI[:\s]*+([\d.]++)\s*[-–,\s]+\s*([\d.]++)", re.IGNORECASE)
+# (the \s* before [,\s] stays greedy: "[0.1 0.2]" needs it to give the space back)
+_CI_BRACKET_RE = re.compile(r"[\[(]([\d.]++)\s*[,\s]\s*+([\d.]++)[\])]")
+_PERCENT_RE = re.compile(r"(?<![\d.])([\d.]++)\s*+%")
+_N_VALUE_RE = re.compile(r"[Nn]\s*+=\s*+([\d,]++)")
+_DURATION_RE = re.compile(r"(?<![\d.])([\d.]++)\s*+(months?|years?|weeks?)", re.IGNORECASE)
+_DOSAGE_RE = re.compile(r"(?<![\d.])([\d.]++)\s*+(Gy|mg/?m[²2]?)", re.IGNORECASE)
+# Words ignored when comparing a quote's content words with the source
+_STOP_WORDS = frozenset({
+    "the", "a", "an", "is", "are", "was", "were", "of", "in", "to", "and", "for", "with", "that", "this", "by",
+})
+# Punctuation trimmed off word edges when matching quote words to source tokens
+_TOKEN_EDGE_PUNCT = ".,;:!?()[]{}\"'“”‘’"
+# Label a safety claim is shown with ("Adverse event: nausea"); stripped off
+# corrections in case the LLM echoes it back into the rewrite
+_SAFETY_LABEL_RE = re.compile(r"^\s*(?:serious\s+)?adverse\s+event\s*:\s*", re.IGNORECASE)
+# Every number token in the source: 1,234 (thousands) | 0.64 / .64 | 12.
+# The lookahead lets the scan skip non-numeric positions without trying
+# each alternative.
+_NUMBER_RE = re.compile(r"(?=[\d.])(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d*\.\d+|\d+)")
+
+
+# Both grounding calls run at temperature 0, so an identical request (same
+# deployment, messages and max_tokens) gets the same answer. Responses are
+# keyed by a SHA-256 of everything sent; re-validating the same output for
+# the same paper then skips the API entirely.
+_llm_cache: OrderedDict[str, str] = OrderedDict()
+
+
+def _llm_cache_key(messages: list[dict], max_tokens: int) -> str:
+    h = hashlib.sha256()
+    for part in (DEPLOYMENT, str(max_tokens), *(m["role"] + "\0" + m["content"] for m in messages)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# Whole validate_grounding results, keyed by (output, source, skip_llm).
+# Given the same inputs every step is deterministic (the LLM calls included,
+# see above), so re-running a document skips the regex / fuzzy work too.
+# Results are stored serialised so callers can't mutate the cached copy.
+_result_cache: OrderedDict[tuple, bytes] = OrderedDict()
+
+
+def _result_cache_key(output: dict, source_text: str, skip_llm: bool) -> tuple | None:
+    try:
+        output_json = orjson.dumps(output, option=orjson.OPT_SORT_KEYS)
+    except TypeError:  # not orjson-serialisable (e.g. a >64-bit int) — don't cache
+        return None
+    return (
+        hashlib.blake2b(output_json, digest_size=16).digest(),
+        hashlib.blake2b(source_text.encode("utf-8"), digest_size=16).digest(),
+        skip_llm,
+    )
 
 
-def _get_client() -> AzureOpenAI:
-    return AzureOpenAI(
-        azure_endpoint=ENDPOINT,
-        api_key=API_KEY,
-        api_version=API_VERSION,
+async def _cached_completion(messages: list[dict], max_tokens: int) -> str:
+    """Return the JSON-mode completion text for messages, from cache when possible."""
+    key = _llm_cache_key(messages, max_tokens)
+    raw = _llm_cache.get(key)
+    if raw is not None:
+        _llm_cache.move_to_end(key)
+        logger.debug("⚡ Grounding LLM response served from cache")
+        return raw
+
+    # Same pooled client / retry policy / RPM pacing as the generation calls
+    response = await chat_completion(
+        get_async_client(),
+        model=DEPLOYMENT,
+        messages=messages,
+        temperature=0.0,
+        max_tokens=max_tokens,
+        response_format={"type": "json_object"},
     )
+    raw = response.choices[0].message.content or ""
+    # Only cache answers that will parse; a truncated reply should be retried
+    orjson.loads(raw)
+    _llm_cache[key] = raw
+    if len(_llm_cache) > LLM_CACHE_SIZE:
+        _llm_cache.popitem(last=False)
+    return raw
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> tiktoken.Encoding | None:
+    # tiktoken fetches the BPE file on first use; without it (offline host)
+    # the excerpt falls back to a character budget
+    try:
+        return tiktoken.get_encoding(SOURCE_TOKENIZER)
+    except Exception as e:
+        logger.warning("⚠️ Tokenizer unavailable, truncating source by characters: %s", e)
+        return None
+
+
+def load_tokenizer() -> None:
+    """
+    Load the excerpt tokenizer ahead of the first grounding call. The first
+    load can download the BPE file, so call it off the event loop (the app
+    does, at startup).
+    """
+    _get_encoding()
+
+
+@lru_cache(maxsize=8)
+def _source_excerpt(source_text: str) -> str:
+    """
+    The source as sent to the judge / correction prompts: the first
+    SOURCE_HEAD_TOKENS and last SOURCE_TAIL_TOKENS tokens of a longer paper.
+    Budgeting in tokens keeps the prompt size steady however dense the text;
+    cached so both calls (and every correction round) reuse one tokenization.
+    Encoding a whole paper is CPU-bound: coroutines call this via
+    asyncio.to_thread.
+    """
+    marker = "\n\n[...middle sections omitted for length...]\n\n"
+    enc = _get_encoding()
+    if enc is None:
+        head_chars, tail_chars = SOURCE_HEAD_TOKENS * 4, SOURCE_TAIL_TOKENS * 4
+        if len(source_text) <= head_chars + tail_chars:
+            return source_text
+        return source_text[:head_chars] + marker + source_text[-tail_chars:]
+
+    tokens = enc.encode(source_text, disallowed_special=())
+    if len(tokens) <= SOURCE_HEAD_TOKENS + SOURCE_TAIL_TOKENS:
+        return source_text
+    return enc.decode(tokens[:SOURCE_HEAD_TOKENS]) + marker + enc.decode(tokens[-SOURCE_TAIL_TOKENS:])
 
 
 def _normalize(text: str) -> str:
@@ -63,50 +205,82 @@ def _extract_key_values(text: str) -> list[dict]:
 
     # Extract metric = value pairs (HR=0.64, RR=1.23, OR=2.1)
     # Matches: HR=0.64, HR = 0.64, HR is 0.64, HR of 0.64
-    for m in re.finditer(r"(HR|RR|OR)\s*(?:=|is|of|:)\s*([\d.]+)", text, re.IGNORECASE):
+    for m in _METRIC_RE.finditer(text):
         values.append({"type": "metric", "name": m.group(1).upper(), "value": m.group(2)})
 
     # Extract p-values: p<0.001, p = 0.10, P < 0.00001
-    for m in re.finditer(r"p\s*([<>=]+)\s*([\d.]+)", text, re.IGNORECASE):
+    for m in _P_VALUE_RE.finditer(text):
         values.append({"type": "p_value", "operator": m.group(1), "value": m.group(2)})
 
     # Extract CI bounds: various formats
     # CI: 0.58, 0.71 | CI 0.58-0.71 | CI: 0.58 to 0.71 | [0.58, 0.71]
-    for m in re.finditer(
-        r"CI[:\s]*([\d.]+)\s*[-–,\s]+\s*([\d.]+)",
-        text, re.IGNORECASE
-    ):
+    for m in _CI_RE.finditer(text):
         values.append({"type": "ci", "low": m.group(1), "high": m.group(2)})
 
     # Also catch bracket notation: [0.58, 0.71] or (0.58, 0.71)
-    for m in re.finditer(r"[\[(]([\d.]+)\s*[,\s]\s*([\d.]+)[\])]", text):
+    for m in _CI_BRACKET_RE.finditer(text):
         values.append({"type": "ci_bracket", "low": m.group(1), "high": m.group(2)})
 
     # Extract percentages
-    for m in re.finditer(r"([\d.]+)\s*%", text):
+    for m in _PERCENT_RE.finditer(text):
         values.append({"type": "percent", "value": m.group(1)})
 
     # Extract N= values
-    for m in re.finditer(r"[Nn]\s*=\s*([\d,]+)", text):
+    for m in _N_VALUE_RE.finditer(text):
         values.append({"type": "n_value", "value": m.group(1).replace(",", "")})
 
     # Extract durations: 14.6 months, 2.5 years
-    for m in re.finditer(r"([\d.]+)\s*(months?|years?|weeks?)", text, re.IGNORECASE):
+    for m in _DURATION_RE.finditer(text):
         values.append({"type": "duration", "value": m.group(1), "unit": m.group(2).lower()})
 
     # Extract dosages: 60 Gy, 75 mg/m²
-    for m in re.finditer(r"([\d.]+)\s*(Gy|mg/?m[²2]?)", text, re.IGNORECASE):
+    for m in _DOSAGE_RE.finditer(text):
         values.append({"type": "dosage", "value": m.group(1), "unit": m.group(2)})
 
     return values
 
 
-def _fuzzy_contains(source: str, substring: str, threshold: float = QUOTE_SIMILARITY_THRESHOLD) -> tuple[bool, float]:
+def _quote_anchors(sub_norm: str) -> list[str]:
+    """
+    Adjacent word pairs of the quote to find it by in the source, taken as
+    they stand in the quote (so each is text the source contains verbatim
+    wherever the quote does). Pairs of two content words (no stop words,
+    > 2 chars) come first, in quote order; a quote with none falls back to
+    its first two words. Several candidates let one typo'd word miss
+    without losing the local check.
+    """
+    words = sub_norm.split()
+    is_content = [w not in _STOP_WORDS and len(w) > 2 for w in words]
+    anchors = []
+    for i in range(len(words) - 1):
+        if is_content[i] and is_content[i + 1]:
+            anchor = words[i] + " " + words[i + 1]
+            if anchor not in anchors:
+                anchors.append(anchor)
+                if len(anchors) == MAX_ANCHORS:
+                    break
+    if not anchors and len(words) >= 2:
+        anchors.append(words[0] + " " + words[1])
+    return anchors
+
+
+def _fuzzy_contains(
+    source_norm: str,
+    substring: str,
+    threshold: float = QUOTE_SIMILARITY_THRESHOLD,
+    full_scan: bool = True,
+    source_tokens: frozenset[str] | None = None,
+) -> tuple[bool, float]:
     """
-    Check if `substring` approximately appears in `source` using multiple strategies.
+    Check if `substring` approximately appears in the (already normalized)
+    source using multiple strategies.
     Returns (is_match, best_ratio).
+
+    full_scan=False stops before the whole-source partial_ratio, so callers
+    can batch that last step for many substrings (see _verify_quotes).
+    With source_tokens (from _build_token_index) content words are looked
+    up as whole source words instead of substring-scanned.
     """
-    source_norm = _normalize(source)
     sub_norm = _normalize(substring)
 
     # Exact substring check first
@@ -120,50 +294,117 @@ def _fuzzy_contains(source: str, substring: str, threshold: float = QUOTE_SIMILA
 
     # Strategy 1: Check if key content words from the quote appear together
     # (handles OCR artifacts like "sur- vival" → "survival")
-    stop_words = {"the", "a", "an", "is", "are", "was", "were", "of", "in", "to", "and", "for", "with", "that", "this", "by"}
-    content_words = [w for w in sub_norm.split() if w not in stop_words and len(w) > 2]
+    content_words = [w for w in sub_norm.split() if w not in _STOP_WORDS and len(w) > 2]
     if content_words:
-        words_found = sum(1 for w in content_words if w in source_norm)
+        if source_tokens is not None:
+            words_found = sum(
+                1 for w in content_words
+                if w in source_tokens or w.strip(_TOKEN_EDGE_PUNCT) in source_tokens
+            )
+        else:
+            words_found = sum(1 for w in content_words if w in source_norm)
         word_ratio = words_found / len(content_words)
         best_ratio = max(best_ratio, word_ratio)
-        if word_ratio >= 0.85:
+        # best_ratio only grows from here, so once the word ratio clears the
+        # threshold the quote is a match whatever Strategy 2 would score
+        if word_ratio >= min(threshold, 0.85):
             return True, word_ratio
 
-    # Strategy 2: Sliding window with word-level stepping
-    words = source_norm.split()
-    sub_word_count = len(sub_norm.split())
-
-    # Use multiple window sizes for flexibility
-    for size_offset in range(-2, 4):
-        win_size = sub_word_count + size_offset
-        if win_size < 3 or win_size > len(words):
-            continue
-        # Step through with stride of 2 for speed
-        for i in range(0, max(1, len(words) - win_size + 1), 2):
-            window = " ".join(words[i:i + win_size])
-            ratio = SequenceMatcher(None, sub_norm, window).ratio()
+    # Strategy 2: best-aligned window of the source (RapidFuzz partial_ratio,
+    # C++ — replaces a pure-Python SequenceMatcher sliding window).
+    # Anchors found with str.find are scored in their neighbourhood first, so
+    # a quote that matches near one skips the full-source scan.
+    hits = 0
+    for anchor in _quote_anchors(sub_norm):
+        hit = source_norm.find(anchor)
+        while hit != -1 and hits < MAX_ANCHOR_HITS:
+            region = source_norm[max(0, hit - len(sub_norm)):hit + 2 * len(sub_norm)]
+            ratio = fuzz.partial_ratio(sub_norm, region) / 100.0
             best_ratio = max(best_ratio, ratio)
             if ratio >= threshold:
                 return True, ratio
+            hit = source_norm.find(anchor, hit + 1)
+            hits += 1
+
+    if not full_scan:
+        return False, best_ratio
+
+    ratio = fuzz.partial_ratio(sub_norm, source_norm) / 100.0
+    best_ratio = max(best_ratio, ratio)
 
     return best_ratio >= threshold, best_ratio
 
 
-def _find_value_in_source(value: str, source_norm: str) -> bool:
-    """Check if a numeric value appears anywhere in the source text."""
-    # Direct search for the number
-    if value in source_norm:
+def _build_number_index(source_norm: str) -> set[str]:
+    """
+    Set of number tokens in the source, thousands separators dropped
+    (N=1234 matches "1,234"). 0.x tokens are also indexed as .x, so a
+    claim's leading zero never matters.
+    """
+    numbers = set()
+    for token in _NUMBER_RE.findall(source_norm):
+        token = token.replace(",", "")
+        numbers.add(token)
+        if token.startswith("0."):
+            numbers.add(token[1:])
+    return numbers
+
+
+@lru_cache(maxsize=8)
+def _build_token_index(source_norm: str) -> frozenset[str]:
+    """Source words, each also indexed with edge punctuation trimmed ("survival," → "survival")."""
+    tokens = set(source_norm.split())
+    tokens.update([t.strip(_TOKEN_EDGE_PUNCT) for t in tokens])
+    return frozenset(tokens)
+
+
+def _find_value_in_source(value: str, source_numbers: set[str]) -> bool:
+    """Check if a numeric value appears as a number token in the source."""
+    # A claim value can end in a sentence full stop ("HR=0.64.")
+    value = value.rstrip(".")
+    if value in source_numbers:
         return True
     # Try without leading zero: .64 for 0.64
-    if value.startswith("0.") and value[1:] in source_norm:
-        return True
-    return False
+    return value.startswith("0.") and value[1:] in source_numbers
+
+
+@lru_cache(maxsize=8)
+def _build_source_index(source_text: str) -> dict:
+    """
+    Everything the checks need from the source paper, computed once per
+    paper instead of once per finding / quote: the normalized text plus
+    lookup sets of its extracted statistics. Cached, so every correction
+    round's re-validation reuses the first call's index — treat it as
+    read-only.
+    """
+    source_metrics = set()  # {("HR", "0.64")} etc
+    source_ci_bounds = set()  # all CI bound values
+    source_p_values = set()  # all p-value numbers
+
+    for sv in _extract_key_values(source_text):
+        if sv["type"] == "metric":
+            source_metrics.add((sv["name"], sv["value"]))
+        elif sv["type"] in ("ci", "ci_bracket"):
+            source_ci_bounds.add(sv["low"])
+            source_ci_bounds.add(sv["high"])
+        elif sv["type"] == "p_value":
+            source_p_values.add(sv["value"])
 
+    source_norm = _normalize(source_text)
+    return {
+        "norm": source_norm,
+        "numbers": _build_number_index(source_norm),
+        "metrics": source_metrics,
+        "ci_bounds": source_ci_bounds,
+        "p_values": source_p_values,
+    }
 
-def _verify_stat_evidence(stat_text: str, source_text: str) -> dict:
+
+def _verify_stat_evidence(stat_text: str, source: dict) -> dict:
     """
     Verify statistical evidence by extracting KEY VALUES (numbers) and checking
-    if those values appear in the source. This is format-agnostic:
+    if those values appear in the source (a _build_source_index result).
+    This is format-agnostic:
     'HR=0.64' matches 'HR is 0.64', 'HR of 0.64', 'HR: 0.64', etc.
     'CI 0.58-0.71' matches 'CI: 0.58, 0.71', '[0.58, 0.71]', etc.
     """
@@ -171,32 +412,15 @@ def _verify_stat_evidence(stat_text: str, source_text: str) -> dict:
     if not claim_values:
         return {"grounded": None, "score": 0.0, "found": [], "missing": [], "detail": "no_stats_to_verify"}
 
-    source_norm = _normalize(source_text)
-    source_values = _extract_key_values(source_text)
+    source_norm = source["norm"]
+    source_numbers = source["numbers"]
+    source_metrics = source["metrics"]
+    source_ci_bounds = source["ci_bounds"]
+    source_p_values = source["p_values"]
 
     found = []
     missing = []
-
-    # Build lookup sets from source
-    source_metrics = {}  # {("HR", "0.64")} etc
-    source_ci_bounds = set()  # all CI bound values
-    source_p_values = set()  # all p-value numbers
-    source_all_numbers = set()  # all numbers found
-
-    for sv in source_values:
-        if sv["type"] == "metric":
-            source_metrics[(sv["name"], sv["value"])] = True
-            source_all_numbers.add(sv["value"])
-        elif sv["type"] in ("ci", "ci_bracket"):
-            source_ci_bounds.add(sv["low"])
-            source_ci_bounds.add(sv["high"])
-            source_all_numbers.add(sv["low"])
-            source_all_numbers.add(sv["high"])
-        elif sv["type"] == "p_value":
-            source_p_values.add(sv["value"])
-            source_all_numbers.add(sv["value"])
-        elif sv["type"] in ("percent", "n_value", "duration", "dosage"):
-            source_all_numbers.add(sv["value"])
+    seen = set()  # labels already recorded (a value cited twice counts once)
 
     for cv in claim_values:
         label = ""
@@ -208,7 +432,7 @@ def _verify_stat_evidence(stat_text: str, source_text: str) -> dict:
             if (cv["name"], cv["value"]) in source_metrics:
                 is_found = True
             # Fallback: just check if the number appears near the metric name
-            elif _find_value_in_source(cv["value"], source_norm):
+            elif _find_value_in_source(cv["value"], source_numbers):
                 # Verify the metric name is also somewhere in source
                 if cv["name"].lower() in source_norm:
                     is_found = True
@@ -216,14 +440,14 @@ def _verify_stat_evidence(stat_text: str, source_text: str) -> dict:
         elif cv["type"] == "ci":
             label = f"CI {cv['low']}-{cv['high']}"
             # Check if both bounds appear in source CI data
-            low_found = cv["low"] in source_ci_bounds or _find_value_in_source(cv["low"], source_norm)
-            high_found = cv["high"] in source_ci_bounds or _find_value_in_source(cv["high"], source_norm)
+            low_found = cv["low"] in source_ci_bounds or _find_value_in_source(cv["low"], source_numbers)
+            high_found = cv["high"] in source_ci_bounds or _find_value_in_source(cv["high"], source_numbers)
             is_found = low_found and high_found
 
         elif cv["type"] == "ci_bracket":
             label = f"[{cv['low']}, {cv['high']}]"
-            low_found = cv["low"] in source_ci_bounds or _find_value_in_source(cv["low"], source_norm)
-            high_found = cv["high"] in source_ci_bounds or _find_value_in_source(cv["high"], source_norm)
+            low_found = cv["low"] in source_ci_bounds or _find_value_in_source(cv["low"], source_numbers)
+            high_found = cv["high"] in source_ci_bounds or _find_value_in_source(cv["high"], source_numbers)
             is_found = low_found and high_found
 
         elif cv["type"] == "p_value":
@@ -246,33 +470,32 @@ def _verify_stat_evidence(stat_text: str, source_text: str) -> dict:
                     pass
             # Fallback: check if the exact value appears
             if not is_found:
-                is_found = _find_value_in_source(cv["value"], source_norm)
+                is_found = _find_value_in_source(cv["value"], source_numbers)
 
         elif cv["type"] == "percent":
             label = f"{cv['value']}%"
-            is_found = _find_value_in_source(cv["value"], source_norm)
+            is_found = _find_value_in_source(cv["value"], source_numbers)
 
         elif cv["type"] == "n_value":
             label = f"N={cv['value']}"
-            is_found = _find_value_in_source(cv["value"], source_norm)
+            is_found = _find_value_in_source(cv["value"], source_numbers)
 
         elif cv["type"] == "duration":
             label = f"{cv['value']} {cv['unit']}"
-            is_found = _find_value_in_source(cv["value"], source_norm)
+            is_found = _find_value_in_source(cv["value"], source_numbers)
 
         elif cv["type"] == "dosage":
             label = f"{cv['value']} {cv['unit']}"
-            is_found = _find_value_in_source(cv["value"], source_norm)
+            is_found = _find_value_in_source(cv["value"], source_numbers)
 
+        if label in seen:
+            continue
+        seen.add(label)
         if is_found:
             found.append(label)
         else:
             missing.append(label)
 
-    # Deduplicate
-    found = list(dict.fromkeys(found))
-    missing = list(dict.fromkeys(missing))
-
     total = len(found) + len(missing)
     score = len(found) / total if total > 0 else 0.0
     grounded = score >= STAT_MATCH_THRESHOLD
@@ -285,9 +508,15 @@ def _verify_stat_evidence(stat_text: str, source_text: str) -> dict:
     }
 
 
-def _verify_quotes(quotes: list[str], source_text: str) -> list[dict]:
-    """Verify each supporting quote against source text."""
+def _verify_quotes(quotes: list[str], source: dict) -> list[dict]:
+    """Verify each supporting quote against the source (a _build_source_index result)."""
+    source_norm = source["norm"]
+    # Word index for Strategy 1, built on the first quote that isn't an exact
+    # substring (verbatim quotes never need it)
+    source_tokens = None
     results = []
+    # Quotes the cheap strategies can't place: (result index, normalized quote)
+    pending = []
     for quote in quotes:
         if not quote or len(quote.strip()) < 10:
             results.append({
@@ -298,16 +527,39 @@ def _verify_quotes(quotes: list[str], source_text: str) -> list[dict]:
             })
             continue
 
-        is_match, ratio = _fuzzy_contains(source_text, quote)
+        if source_tokens is None and _normalize(quote) not in source_norm:
+            source_tokens = _build_token_index(source_norm)
+        is_match, ratio = _fuzzy_contains(
+            source_norm, quote, full_scan=False, source_tokens=source_tokens
+        )
+        if not is_match:
+            pending.append((len(results), _normalize(quote)))
         results.append({
             "quote": quote[:100] + ("…" if len(quote) > 100 else ""),
             "grounded": is_match,
-            "score": round(ratio, 2),
+            "score": ratio,
         })
+
+    # Whole-source scan for the rest in one cdist call: the same
+    # partial_ratio scores, spread across threads outside the GIL
+    if pending:
+        scores = process.cdist(
+            [sub_norm for _, sub_norm in pending],
+            [source_norm],
+            scorer=fuzz.partial_ratio,
+            workers=-1,
+        )
+        for (i, _), score in zip(pending, scores[:, 0]):
+            ratio = max(results[i]["score"], float(score) / 100.0)
+            results[i]["grounded"] = ratio >= QUOTE_SIMILARITY_THRESHOLD
+            results[i]["score"] = ratio
+
+    for result in results:
+        result["score"] = round(result["score"], 2)
     return results
 
 
-def _verify_claims_with_llm(
+async def _verify_claims_with_llm(
     claims: list[dict],
     source_text: str,
 ) -> list[dict]:
@@ -315,24 +567,23 @@ def _verify_claims_with_llm(
     Use LLM-as-judge to verify whether key claims are grounded in source text.
     This is the semantic layer — catches paraphrased hallucinations that
     pass string matching but aren't actually supported.
+
+    Failing verdicts also carry a "suggested_correction" (rewrite, or null
+    to remove), so self-correction can apply them without another call.
     """
     if not claims:
         return []
 
-    client = _get_client()
-
     # Build claims list for verification
     claims_text = ""
     for i, claim in enumerate(claims):
-        claims_text += f"\n[Claim {i+1}]: {claim.get('text', '')}\n"
+        label = f" ({claim['label']})" if claim.get("label") else ""
+        claims_text += f"\n[Claim {i+1}]{label}: {claim.get('text', '')}\n"
         if claim.get("evidence"):
             claims_text += f"  Evidence cited: {claim['evidence']}\n"
 
-    # Truncate source to fit context — take first 15k + last 5k chars
-    if len(source_text) > 20000:
-        truncated = source_text[:15000] + "\n\n[...middle sections omitted for length...]\n\n" + source_text[-5000:]
-    else:
-        truncated = source_text
+    # Truncate source to fit context — head + tail of the paper
+    truncated = await asyncio.to_thread(_source_excerpt, source_text)
 
     prompt = f"""You are a REGULATORY COMPLIANCE AUDITOR for pharmaceutical research.
 
@@ -341,6 +592,9 @@ For each claim, determine:
 - "grounded": true if the claim is directly supported by the text, false if it appears fabricated or unsupported
 - "severity": "ok" if grounded, "warning" if partially supported or ambiguous, "error" if clearly not in the text
 - "reason": brief explanation of your verdict (1 sentence)
+- "suggested_correction": ONLY when "grounded" is false — the claim rewritten using ONLY information from the source text (exact numbers), or null if the text cannot support it and it should be removed.
+  For a claim with "Evidence cited", return an object {{"finding": "...", "statistical_evidence": "..."}} so both are corrected.
+  Do not repeat a claim's (label) in the rewrite.
 
 Be STRICT. In regulatory contexts, even small inaccuracies matter.
 A claim is grounded ONLY if you can point to specific text that supports it.
@@ -355,26 +609,22 @@ SOURCE PAPER TEXT:
 
 Return JSON array:
 [
-  {{"claim_index": 1, "grounded": true/false, "severity": "ok"|"warning"|"error", "reason": "..."}},
+  {{"claim_index": 1, "grounded": true, "severity": "ok", "reason": "..."}},
+  {{"claim_index": 2, "grounded": false, "severity": "error", "reason": "...", "suggested_correction": "..." or null}},
   ...
 ]
 
 Return JSON only."""
 
     try:
-        response = client.chat.completions.create(
-            model=DEPLOYMENT,
-            messages=[
+        raw = await _cached_completion(
+            [
                 {"role": "system", "content": "You are a regulatory compliance auditor. Return valid JSON only."},
                 {"role": "user", "content": prompt},
             ],
-            temperature=0.0,
-            max_tokens=2048,
-            response_format={"type": "json_object"},
+            max_tokens=4096,
         )
-
-        raw = response.choices[0].message.content or ""
-        parsed = json.loads(raw)
+        parsed = orjson.loads(raw)
 
         # Handle both {"results": [...]} and direct [...] formats
         if isinstance(parsed, dict):
@@ -393,12 +643,12 @@ Return JSON only."""
         return verdicts
 
     except Exception as e:
-        print(f"⚠️ LLM grounding check failed: {e}")
+        logger.warning("⚠️ LLM grounding check failed: %s", e)
         return [{"claim_index": i + 1, "grounded": None, "severity": "warning",
-                 "reason": f"Verification failed: {str(e)}"} for i in range(len(claims))]
+                 "reason": f"Verification failed: {str(e)}", "failed": True} for i in range(len(claims))]
 
 
-def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -> dict:
+async def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -> dict:
     """
     Main entry point: validate an LLM output dict against source paper text.
 
@@ -422,11 +672,19 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
         }
     }
     """
+    cache_key = _result_cache_key(output, source_text, skip_llm)
+    cached = _result_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        _result_cache.move_to_end(cache_key)
+        logger.info("⚡ Grounding result served from cache")
+        return orjson.loads(cached)
+
     mode = "fast (regex+fuzzy only)" if skip_llm else "full (regex+fuzzy+LLM)"
-    print(f"🔍 Running grounding validation ({mode})...")
+    logger.info(f"🔍 Running grounding validation ({mode})...")
 
     details = {}
     all_verdicts = []
+    source = _build_source_index(source_text)
 
     # ── 1. Verify statistical evidence in key findings ──
     findings = output.get("key_findings", [])
@@ -440,7 +698,7 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
                 stat_evidence = finding.get("statistical_evidence", "")
 
                 # String-match statistical numbers
-                stat_check = _verify_stat_evidence(stat_evidence, source_text) if stat_evidence else {
+                stat_check = _verify_stat_evidence(stat_evidence, source) if stat_evidence else {
                     "grounded": None, "score": 0.0, "detail": "no_evidence_provided"
                 }
                 stat_results.append({
@@ -469,7 +727,7 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
     # ── 2. Verify supporting quotes ──
     quotes = output.get("supporting_quotes", [])
     if isinstance(quotes, list) and quotes:
-        quote_results = _verify_quotes(quotes, source_text)
+        quote_results = _verify_quotes(quotes, source)
         details["supporting_quotes"] = quote_results
     else:
         details["supporting_quotes"] = []
@@ -482,7 +740,8 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
             for ae in adverse:
                 ae_text = ae if isinstance(ae, str) else str(ae)
                 claims_for_llm.append({
-                    "text": f"Adverse event: {ae_text}",
+                    "text": ae_text,
+                    "label": "Adverse event",
                     "evidence": "",
                     "type": "safety_claim",
                     "index": len(claims_for_llm),
@@ -493,7 +752,8 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
             for sae in serious:
                 sae_text = sae if isinstance(sae, str) else str(sae)
                 claims_for_llm.append({
-                    "text": f"Serious adverse event: {sae_text}",
+                    "text": sae_text,
+                    "label": "Serious adverse event",
                     "evidence": "",
                     "type": "safety_claim",
                     "index": len(claims_for_llm),
@@ -525,21 +785,32 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
             {"grounded": True, "severity": "ok", "reason": "Accepted after self-correction"}
             for _ in claims_for_llm
         ]
-        print(f"  ⏩ Skipped LLM-as-judge (fast re-validation), {len(claims_for_llm)} claims presumed OK")
+        logger.info(f"⏩ Skipped LLM-as-judge (fast re-validation), {len(claims_for_llm)} claims presumed OK")
     else:
-        llm_verdicts = _verify_claims_with_llm(claims_for_llm, source_text)
+        llm_verdicts = await _verify_claims_with_llm(claims_for_llm, source_text)
 
     # Map verdicts back to claim types
     finding_verdicts = []
     safety_verdicts = []
 
     for claim, verdict in zip(claims_for_llm, llm_verdicts):
+        claim_text = f"{claim['label']}: {claim['text']}" if claim.get("label") else claim["text"]
         entry = {
-            "claim": claim["text"][:120] + ("…" if len(claim["text"]) > 120 else ""),
+            "claim": claim_text[:120] + ("…" if len(claim_text) > 120 else ""),
             "grounded": verdict.get("grounded", None),
             "severity": verdict.get("severity", "warning"),
             "reason": verdict.get("reason", ""),
         }
+        # A finding that cites evidence needs both fields rewritten; a bare
+        # string would keep the flagged evidence, so that one is left to the
+        # correction call instead
+        suggestion = verdict.get("suggested_correction")
+        if (
+            "suggested_correction" in verdict
+            and (entry["grounded"] is False or entry["severity"] == "error")
+            and not (claim["evidence"] and isinstance(suggestion, str))
+        ):
+            entry["suggested_correction"] = suggestion
         if claim["type"] == "key_finding":
             finding_verdicts.append(entry)
         elif claim["type"] == "safety_claim":
@@ -600,8 +871,14 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
     }
 
     status_emoji = {"grounded": "✅", "partially_grounded": "⚠️", "review_needed": "❌"}
-    print(f"🔍 Grounding result: {status_emoji.get(overall_status, '?')} {overall_status} "
-          f"(score={overall_score:.0%}, {grounded}/{total} grounded, {warnings} warnings, {errors} errors)")
+    logger.info(f"🔍 Grounding result: {status_emoji.get(overall_status, '?')} {overall_status} "
+                f"(score={overall_score:.0%}, {grounded}/{total} grounded, {warnings} warnings, {errors} errors)")
+
+    # A failed judge call is transient — leave it uncached so a rerun retries
+    if cache_key and not any(v.get("failed") for v in llm_verdicts):
+        _result_cache[cache_key] = orjson.dumps(result)
+        if len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
 
     return result
 
@@ -612,7 +889,8 @@ def validate_grounding(output: dict, source_text: str, skip_llm: bool = False) -
 def _collect_ungrounded_claims(grounding_result: dict) -> list[dict]:
     """
     Extract all claims that failed grounding (severity=error or grounded=False).
-    Returns a list of dicts with type, claim text, reason, and path into the output dict.
+    Returns a list of dicts with type, claim text, reason, and path into the output dict,
+    plus the judge's suggested_correction when the LLM verification proposed one.
     """
     ungrounded = []
     details = grounding_result.get("details", {})
@@ -620,22 +898,28 @@ def _collect_ungrounded_claims(grounding_result: dict) -> list[dict]:
     # Key findings with grounded=False
     for i, v in enumerate(details.get("key_findings", [])):
         if v.get("grounded") is False or v.get("severity") == "error":
-            ungrounded.append({
+            ug = {
                 "type": "key_finding",
                 "index": i,
                 "claim": v.get("claim", ""),
                 "reason": v.get("reason", ""),
-            })
+            }
+            if "suggested_correction" in v:
+                ug["suggested_correction"] = v["suggested_correction"]
+            ungrounded.append(ug)
 
     # Safety claims with grounded=False
     for i, v in enumerate(details.get("safety_claims", [])):
         if v.get("grounded") is False or v.get("severity") == "error":
-            ungrounded.append({
+            ug = {
                 "type": "safety_claim",
                 "index": i,
                 "claim": v.get("claim", ""),
                 "reason": v.get("reason", ""),
-            })
+            }
+            if "suggested_correction" in v:
+                ug["suggested_correction"] = v["suggested_correction"]
+            ungrounded.append(ug)
 
     # Supporting quotes with grounded=False
     for i, v in enumerate(details.get("supporting_quotes", [])):
@@ -661,7 +945,27 @@ def _collect_ungrounded_claims(grounding_result: dict) -> list[dict]:
     return ungrounded
 
 
-def correct_ungrounded_claims(
+def _copy_correctable(output: dict) -> dict:
+    """
+    Copy of `output` that corrections can edit without touching the original.
+    Only the containers correct_ungrounded_claims mutates are copied (the
+    key_findings / supporting_quotes lists and the safety_profile event
+    lists); everything else is shared with `output`.
+    """
+    corrected = dict(output)
+    for key in ("key_findings", "supporting_quotes"):
+        if isinstance(corrected.get(key), list):
+            corrected[key] = list(corrected[key])
+    safety = corrected.get("safety_profile")
+    if isinstance(safety, dict):
+        safety = corrected["safety_profile"] = dict(safety)
+        for key in ("adverse_events", "serious_adverse_events"):
+            if isinstance(safety.get(key), list):
+                safety[key] = list(safety[key])
+    return corrected
+
+
+async def correct_ungrounded_claims(
     output: dict,
     source_text: str,
     grounding_result: dict,
@@ -675,29 +979,42 @@ def correct_ungrounded_claims(
     """
     ungrounded = _collect_ungrounded_claims(grounding_result)
     if not ungrounded:
-        print("✅ No ungrounded claims to correct.")
+        logger.info("✅ No ungrounded claims to correct.")
         return output, []
 
-    print(f"🔧 Self-correction: {len(ungrounded)} ungrounded claims found, sending to LLM for correction...")
+    # Claims the LLM judge already failed come with its suggested fix, so only
+    # the rest (quote / stat failures, verdicts without a suggestion) need a
+    # correction round trip
+    corrections = [
+        {
+            "error_index": i + 1,
+            "action": "correct" if ug["suggested_correction"] is not None else "remove",
+            "original_index": ug["index"],
+            "corrected_value": ug["suggested_correction"],
+        }
+        for i, ug in enumerate(ungrounded)
+        if "suggested_correction" in ug
+    ]
+    pending = [(i, ug) for i, ug in enumerate(ungrounded) if "suggested_correction" not in ug]
+    if corrections:
+        logger.info(f"🔧 Self-correction: applying {len(corrections)} corrections suggested during verification")
 
-    client = _get_client()
+    if pending:
+        logger.info(f"🔧 Self-correction: {len(pending)} ungrounded claims found, sending to LLM for correction...")
 
-    # Build the ungrounded claims block for the prompt
-    claims_block = ""
-    for i, ug in enumerate(ungrounded):
-        claims_block += f"\n[Error {i+1}] Type: {ug['type']}\n"
-        claims_block += f"  Claim: {ug['claim']}\n"
-        claims_block += f"  Reason it failed: {ug['reason']}\n"
+        # Build the ungrounded claims block for the prompt
+        claims_block = ""
+        for i, ug in pending:
+            claims_block += f"\n[Error {i+1}] Type: {ug['type']}\n"
+            claims_block += f"  Claim: {ug['claim']}\n"
+            claims_block += f"  Reason it failed: {ug['reason']}\n"
 
-    # Truncate source to fit context
-    if len(source_text) > 20000:
-        truncated = source_text[:15000] + "\n\n[...middle omitted...]\n\n" + source_text[-5000:]
-    else:
-        truncated = source_text
+        # Truncate source to fit context (same excerpt as the judge call)
+        truncated = await asyncio.to_thread(_source_excerpt, source_text)
 
-    prompt = f"""You are a regulatory compliance editor for pharmaceutical research outputs.
+        prompt = f"""You are a regulatory compliance editor for pharmaceutical research outputs.
 
-The following LLM output was validated against the source paper, and {len(ungrounded)} claims were flagged as UNGROUNDED (not supported by the source text).
+The following LLM output was validated against the source paper, and {len(pending)} claims were flagged as UNGROUNDED (not supported by the source text).
 
 Your task: For each ungrounded claim, decide:
 1. **CORRECT** it: Rewrite using ONLY information from the source text. Keep the same field structure.
@@ -707,7 +1024,7 @@ UNGROUNDED CLAIMS:
 {claims_block}
 
 CURRENT OUTPUT (JSON):
-{json.dumps(output, indent=2)[:8000]}
+{orjson.dumps(output, option=orjson.OPT_INDENT_2).decode()[:8000]}
 
 SOURCE PAPER TEXT:
 {truncated}
@@ -736,32 +1053,40 @@ Return a JSON object with this structure:
 
 Return JSON only."""
 
-    try:
-        response = client.chat.completions.create(
-            model=DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": "You are a regulatory compliance editor. Return valid JSON only."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.0,
-            max_tokens=2048,
-            response_format={"type": "json_object"},
-        )
-
-        raw = response.choices[0].message.content or ""
-        parsed = json.loads(raw)
-        corrections = parsed.get("corrections", [])
-
-    except Exception as e:
-        print(f"⚠️ Self-correction LLM call failed: {e}")
-        return output, []
+        try:
+            raw = await _cached_completion(
+                [
+                    {"role": "system", "content": "You are a regulatory compliance editor. Return valid JSON only."},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=2048,
+            )
+            parsed = orjson.loads(raw)
+            corrections.extend(parsed.get("corrections", []))
+
+        except Exception as e:
+            logger.warning("⚠️ Self-correction LLM call failed: %s", e)
+            if not corrections:
+                return output, []
 
     # Apply corrections to a copy of the output
-    import copy
-    corrected = copy.deepcopy(output)
+    corrected = _copy_correctable(output)
     applied = []
     removal_indices = {"key_finding": [], "safety_claim": [], "supporting_quote": [], "stat_evidence": []}
 
+    # Containers corrections write to, resolved once. Safety claims are
+    # numbered across adverse_events then serious_adverse_events; in-place
+    # corrections never change the list lengths, so ae_len holds throughout.
+    findings = corrected.get("key_findings", [])
+    quotes = corrected.get("supporting_quotes", [])
+    safety = corrected.get("safety_profile")
+    if not isinstance(safety, dict):
+        safety = {}
+    ae_list = safety.get("adverse_events", [])
+    sae_list = safety.get("serious_adverse_events", [])
+    ae_len = len(ae_list)
+    safety_len = ae_len + len(sae_list)
+
     for corr in corrections:
         error_idx = corr.get("error_index", 0) - 1  # 1-based → 0-based
         if error_idx < 0 or error_idx >= len(ungrounded):
@@ -776,13 +1101,12 @@ Return JSON only."""
         try:
             if action == "correct" and corrected_value is not None:
                 if claim_type == "key_finding":
-                    findings = corrected.get("key_findings", [])
                     if 0 <= original_idx < len(findings):
                         old_val = findings[original_idx]
                         if isinstance(old_val, dict) and isinstance(corrected_value, dict):
                             findings[original_idx] = {**old_val, **corrected_value}
                         elif isinstance(old_val, dict) and isinstance(corrected_value, str):
-                            findings[original_idx]["finding"] = corrected_value
+                            findings[original_idx] = {**old_val, "finding": corrected_value}
                         else:
                             findings[original_idx] = corrected_value
                         applied.append({
@@ -791,12 +1115,10 @@ Return JSON only."""
                             "original": ug["claim"],
                             "corrected": str(corrected_value)[:200],
                         })
-                        print(f"  ✏️  Corrected key_finding[{original_idx}]")
+                        logger.debug("✏️  Corrected key_finding[%s]", original_idx)
 
                 elif claim_type == "supporting_quote":
-                    quotes = corrected.get("supporting_quotes", [])
                     if 0 <= original_idx < len(quotes) and isinstance(corrected_value, str):
-                        old_quote = quotes[original_idx]
                         quotes[original_idx] = corrected_value
                         applied.append({
                             "type": claim_type,
@@ -804,26 +1126,23 @@ Return JSON only."""
                             "original": ug["claim"],
                             "corrected": corrected_value[:200],
                         })
-                        print(f"  ✏️  Corrected supporting_quote[{original_idx}]")
+                        logger.debug("✏️  Corrected supporting_quote[%s]", original_idx)
 
                 elif claim_type == "safety_claim":
                     # Safety claims need special handling — they come from adverse_events/serious_adverse_events
-                    safety = corrected.get("safety_profile", {})
-                    ae_list = safety.get("adverse_events", [])
-                    sae_list = safety.get("serious_adverse_events", [])
-                    combined = ae_list + sae_list
-                    if 0 <= original_idx < len(combined) and isinstance(corrected_value, str):
-                        if original_idx < len(ae_list):
+                    if 0 <= original_idx < safety_len and isinstance(corrected_value, str):
+                        corrected_value = _SAFETY_LABEL_RE.sub("", corrected_value)
+                        if original_idx < ae_len:
                             ae_list[original_idx] = corrected_value
                         else:
-                            sae_list[original_idx - len(ae_list)] = corrected_value
+                            sae_list[original_idx - ae_len] = corrected_value
                         applied.append({
                             "type": claim_type,
                             "action": "corrected",
                             "original": ug["claim"],
                             "corrected": corrected_value[:200],
                         })
-                        print(f"  ✏️  Corrected safety_claim[{original_idx}]")
+                        logger.debug("✏️  Corrected safety_claim[%s]", original_idx)
 
             elif action == "remove":
                 removal_indices[claim_type].append(original_idx)
@@ -833,40 +1152,28 @@ Return JSON only."""
                     "original": ug["claim"],
                     "corrected": None,
                 })
-                print(f"  🗑️  Marked {claim_type}[{original_idx}] for removal")
+                logger.debug("🗑️  Marked %s[%s] for removal", claim_type, original_idx)
 
         except (IndexError, KeyError, TypeError) as e:
-            print(f"  ⚠️  Failed to apply correction for error {error_idx + 1}: {e}")
+            logger.warning("⚠️  Failed to apply correction for error %d: %s", error_idx + 1, e)
 
-    # Apply removals (in reverse order to preserve indices)
+    # Apply removals: one filtering pass per list (indices refer to the
+    # lists as they were before any removal)
     for claim_type, indices in removal_indices.items():
         if not indices:
             continue
-        indices_sorted = sorted(set(indices), reverse=True)
+        remove = set(indices)
         if claim_type == "key_finding":
-            findings = corrected.get("key_findings", [])
-            for idx in indices_sorted:
-                if 0 <= idx < len(findings):
-                    findings.pop(idx)
+            findings[:] = [v for i, v in enumerate(findings) if i not in remove]
         elif claim_type == "supporting_quote":
-            quotes = corrected.get("supporting_quotes", [])
-            for idx in indices_sorted:
-                if 0 <= idx < len(quotes):
-                    quotes.pop(idx)
+            quotes[:] = [v for i, v in enumerate(quotes) if i not in remove]
         elif claim_type == "safety_claim":
-            safety = corrected.get("safety_profile", {})
-            ae_list = safety.get("adverse_events", [])
-            sae_list = safety.get("serious_adverse_events", [])
-            for idx in indices_sorted:
-                if idx < len(ae_list):
-                    ae_list.pop(idx)
-                else:
-                    sae_idx = idx - len(ae_list)
-                    if 0 <= sae_idx < len(sae_list):
-                        sae_list.pop(sae_idx)
-
-    print(f"🔧 Self-correction complete: {len(applied)} changes applied "
-          f"({sum(1 for a in applied if a['action'] == 'corrected')} corrected, "
-          f"{sum(1 for a in applied if a['action'] == 'removed')} removed)")
+            # Split the combined safety numbering back into the two lists
+            ae_list[:] = [v for i, v in enumerate(ae_list) if i not in remove]
+            sae_list[:] = [v for i, v in enumerate(sae_list) if i + ae_len not in remove]
+
+    logger.info(f"🔧 Self-correction complete: {len(applied)} changes applied "
+                f"({sum(1 for a in applied if a['action'] == 'corrected')} corrected, "
+                f"{sum(1 for a in applied if a['action'] == 'removed')} removed)")
 
     return corrected, applied
@@ -0,0 +1,44 @@
+"""
+Content-addressed cache of GPT-4o vision descriptions (vision_cache table).
+
+Keys hash the image bytes together with everything else that shapes the
+answer (deployment, system prompt, caption), so the same figure seen in
+another upload — or a re-uploaded paper — is described without a vision call,
+and editing the prompt or switching models naturally misses.
+"""
+
+import hashlib
+from app.db.models import acquire_db
+
+
+def cache_key(image_sha256: str, caption: str, deployment: str, system_prompt: str) -> str:
+    h = hashlib.sha256()
+    for part in (deployment, system_prompt, caption, image_sha256):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+async def get_descriptions(keys: list[str]) -> dict[str, str]:
+    """Return {key: description} for the keys that are cached."""
+    if not keys:
+        return {}
+    placeholders = ",".join("?" * len(keys))
+    async with acquire_db() as db:
+        cursor = await db.execute(
+            f"SELECT key, description FROM vision_cache WHERE key IN ({placeholders})",
+            keys,
+        )
+        rows = await cursor.fetchall()
+    return {row["key"]: row["description"] for row in rows}
+
+
+async def save_descriptions(descriptions: dict[str, str]) -> None:
+    if not descriptions:
+        return
+    async with acquire_db(write=True) as db:
+        await db.executemany(
+            "INSERT OR REPLACE INTO vision_cache (key, description) VALUES (?, ?)",
+            list(descriptions.items()),
+        )
+        await db.commit()
@@ -6,31 +6,37 @@ Includes grounding validation with self-correction loop for regulatory complianc
 """
 
 import os
-import json
+import asyncio
+import logging
+import orjson
+from typing import Callable
 
 from app.services.aoai import generate_structured_output, describe_figures
 from app.services.grounding import validate_grounding, correct_ungrounded_claims
+from app.utils.paths import FIG_CACHE_DIR
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
-FIG_CACHE_DIR = os.path.join(DATA_DIR, "figure_descriptions")
+logger = logging.getLogger(__name__)
 
-MAX_CORRECTION_ROUNDS = 1  # Max self-correction attempts before giving up
+MAX_CORRECTION_ROUNDS = int(os.getenv("MAX_CORRECTION_ROUNDS", "1"))  # Max self-correction attempts before giving up
+# A further round is only worth it if the last one needed clearly fewer
+# changes than the one before (< 80%); otherwise corrections are not settling
+CORRECTION_SHRINK_RATIO = 0.8
 
 
 def _load_cached_descriptions(doc_id: str) -> list[dict] | None:
     """Return cached figure descriptions for doc_id, or None if not cached."""
     path = os.path.join(FIG_CACHE_DIR, f"{doc_id}.json")
-    if os.path.exists(path):
-        with open(path, "r") as f:
-            return json.load(f)
-    return None
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
 
 
 def _save_cached_descriptions(doc_id: str, descriptions: list[dict]) -> None:
-    os.makedirs(FIG_CACHE_DIR, exist_ok=True)
     path = os.path.join(FIG_CACHE_DIR, f"{doc_id}.json")
-    with open(path, "w") as f:
-        json.dump(descriptions, f, indent=2)
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(descriptions, option=orjson.OPT_INDENT_2))
 
 
 async def run_workflow(
@@ -40,79 +46,127 @@ async def run_workflow(
     sections: list[dict] | None = None,
     figure_images: list[dict] | None = None,
     doc_id: str | None = None,
+    figure_loader: Callable[[], list[dict]] | None = None,
+    prepared_prompt: str | None = None,
 ) -> dict:
     """
     Execute a workflow:
     1. (Optional) Analyse figure images with GPT-4o vision (cached per doc)
     2. Send text through LLM with section-based chunking
     3. Synthesise final structured output
+
+    figure_loader lets the caller defer reading images from disk: it is only
+    called when the figure descriptions are not already cached.
+    prepared_prompt is the template with {schema_json} already filled in.
     """
     # Step 1: Describe figures — use cache if available
     figure_descriptions = []
-    if figure_images:
+    save_task = None
+    if figure_images or figure_loader:
         if doc_id:
-            cached = _load_cached_descriptions(doc_id)
+            cached = await asyncio.to_thread(_load_cached_descriptions, doc_id)
             if cached is not None:
                 figure_descriptions = cached
-                print(f"⚡ Loaded {len(cached)} cached figure descriptions for doc {doc_id[:8]}")
+                logger.info(f"⚡ Loaded {len(cached)} cached figure descriptions for doc {doc_id[:8]}")
+
+        if not figure_descriptions and not figure_images:
+            figure_images = await asyncio.to_thread(figure_loader)
 
-        if not figure_descriptions:
-            print(f"🖼️  Analysing {len(figure_images)} figures with GPT-4o vision (parallel)...")
+        if not figure_descriptions and figure_images:
+            logger.info(f"🖼️  Analysing {len(figure_images)} figures with GPT-4o vision (parallel)...")
             figure_descriptions = await describe_figures(figure_images)
             if doc_id:
-                _save_cached_descriptions(doc_id, figure_descriptions)
-                print(f"💾 Cached {len(figure_descriptions)} figure descriptions for doc {doc_id[:8]}")
+                # Written off the event loop while the text is generated
+                # (generation only reads the descriptions)
+                save_task = asyncio.create_task(
+                    asyncio.to_thread(_save_cached_descriptions, doc_id, figure_descriptions)
+                )
 
     # Step 2: Generate structured output with chunking
-    result = await generate_structured_output(
-        prompt_template=prompt_template,
-        schema_json=output_schema_json,
-        text=input_text,
-        sections=sections,
-        figure_descriptions=figure_descriptions,
-    )
+    try:
+        result = await generate_structured_output(
+            prompt_template=prompt_template,
+            schema_json=output_schema_json,
+            text=input_text,
+            sections=sections,
+            figure_descriptions=figure_descriptions,
+            prepared_prompt=prepared_prompt,
+        )
+    finally:
+        if save_task is not None:
+            # Best-effort: a failed cache write must not fail the run or mask
+            # an error from generation
+            try:
+                await save_task
+                logger.info(f"💾 Cached {len(figure_descriptions)} figure descriptions for doc {doc_id[:8]}")
+            except Exception as e:
+                logger.warning("⚠️ Could not cache figure descriptions for doc %s: %s", doc_id[:8], e)
 
     result["figure_descriptions"] = figure_descriptions
 
     # Step 3: Grounding validation with self-correction loop
     if result.get("parsed") and isinstance(result["parsed"], dict):
-        print("🔍 Starting grounding validation...")
-        grounding_result = validate_grounding(result["parsed"], input_text)
+        logger.info("🔍 Starting grounding validation...")
+        grounding_result = await validate_grounding(result["parsed"], input_text)
         all_corrections = []
 
-        # Self-correction loop: if there are errors, try to fix them
+        # Self-correction loop: if there are errors, try to fix them.
+        # converged = stopped because another round could not change anything
+        # (no errors left, or a round that left the output as it was)
         correction_round = 0
+        prev_count = None
+        converged = grounding_result.get("errors", 0) == 0
         while (
             grounding_result.get("errors", 0) > 0
             and correction_round < MAX_CORRECTION_ROUNDS
         ):
             correction_round += 1
-            print(f"\n🔄 Self-correction round {correction_round}/{MAX_CORRECTION_ROUNDS}...")
+            logger.info(f"🔄 Self-correction round {correction_round}/{MAX_CORRECTION_ROUNDS}...")
 
-            corrected_output, corrections_applied = correct_ungrounded_claims(
+            corrected_output, corrections_applied = await correct_ungrounded_claims(
                 result["parsed"], input_text, grounding_result
             )
 
             if not corrections_applied:
-                print("  ⏸️  No corrections could be applied, stopping.")
+                logger.info("⏸️  No corrections could be applied, stopping.")
+                converged = True
+                break
+
+            # The same output would re-validate to the same result
+            if corrected_output == result["parsed"]:
+                logger.info("⏸️  Corrections left the output unchanged, stopping.")
+                converged = True
                 break
 
             all_corrections.extend(corrections_applied)
             result["parsed"] = corrected_output
 
             # Re-validate the corrected output (fast mode — skip LLM-as-judge)
-            print("🔍 Re-validating corrected output (fast)...")
-            grounding_result = validate_grounding(corrected_output, input_text, skip_llm=True)
+            logger.info("🔍 Re-validating corrected output (fast)...")
+            grounding_result = await validate_grounding(corrected_output, input_text, skip_llm=True)
+            converged = grounding_result.get("errors", 0) == 0
+
+            cur_count = len(corrections_applied)
+            if (
+                not converged
+                and prev_count is not None
+                and cur_count >= prev_count * CORRECTION_SHRINK_RATIO
+            ):
+                logger.info(f"⏸️  Round {correction_round} needed {cur_count} changes "
+                            f"(previous: {prev_count}), diminishing returns, stopping.")
+                break
+            prev_count = cur_count
 
         # Attach correction metadata
         if all_corrections:
             grounding_result["corrections_applied"] = all_corrections
             grounding_result["correction_rounds"] = correction_round
-            print(f"\n✅ Self-correction complete after {correction_round} round(s): "
-                  f"{len(all_corrections)} total changes")
+            logger.info(f"✅ Self-correction complete after {correction_round} round(s): "
+                        f"{len(all_corrections)} total changes")
         else:
             grounding_result["corrections_applied"] = []
             grounding_result["correction_rounds"] = 0
+        grounding_result["converged"] = converged
 
         result["grounding"] = grounding_result
     else:
@@ -4,28 +4,50 @@ Safely parse JSON from LLM output with fallback extraction.
 
 import json
 import re
+import orjson
+
+# Fenced-block extraction, tried in order: ```json ... ``` | ``` ... ```
+_JSON_FENCE_PATTERNS = (
+    re.compile(r"```json\s*(.*?)\s*```", re.DOTALL),
+    re.compile(r"```\s*(.*?)\s*```", re.DOTALL),
+)
+
+
+def _loads(text: str):
+    # orjson for speed; the stdlib still accepts the few things orjson
+    # rejects (NaN/Infinity, integers past 64 bits), so it gets the last word
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
 
 
 def safe_parse_json(raw: str) -> dict | None:
-    """Try json.loads first, then attempt to extract a JSON substring."""
+    """Try a direct parse first, then attempt to extract a JSON substring."""
     # Direct parse
     try:
-        return json.loads(raw)
+        return _loads(raw)
     except json.JSONDecodeError:
         pass
 
     # Try to find JSON block between ```json ... ``` or { ... }
-    patterns = [
-        r"```json\s*(.*?)\s*```",
-        r"```\s*(.*?)\s*```",
-        r"(\{.*\})",
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, raw, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group(1))
-            except json.JSONDecodeError:
-                continue
+    if "```" in raw:
+        for pattern in _JSON_FENCE_PATTERNS:
+            match = pattern.search(raw)
+            if match:
+                try:
+                    return _loads(match.group(1))
+                except json.JSONDecodeError:
+                    continue
+
+    # Outermost braces: first "{" through last "}" — the span a greedy
+    # DOTALL {.*} would match, found without a regex scan per "{"
+    start = raw.find("{")
+    end = raw.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return _loads(raw[start:end + 1])
+        except json.JSONDecodeError:
+            pass
 
     return None
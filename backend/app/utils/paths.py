@@ -0,0 +1,19 @@
+"""
+On-disk layout under backend/data/.
+Directory paths are resolved once at import and created once at startup,
+so request handlers only join a filename onto them.
+"""
+
+import os
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "data"))
+PARSED_DIR = os.path.join(DATA_DIR, "parsed")
+RUNS_DIR = os.path.join(DATA_DIR, "runs")
+FIGURES_DIR = os.path.join(DATA_DIR, "figures")
+FIG_CACHE_DIR = os.path.join(DATA_DIR, "figure_descriptions")
+
+
+def ensure_data_dirs() -> None:
+    """Create every data/ subdirectory. Called once from lifespan."""
+    for path in (PARSED_DIR, RUNS_DIR, FIGURES_DIR, FIG_CACHE_DIR):
+        os.makedirs(path, exist_ok=True)
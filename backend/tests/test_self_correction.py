@@ -0,0 +1,110 @@
+"""
+Self-correction applying the LLM judge's suggested corrections.
+
+The LLM is replaced by a fake _cached_completion: the judge prompt gets the
+canned verdicts, the correction prompt the canned corrections.
+
+Run from backend/:  python -m unittest discover -s tests
+"""
+
+import asyncio
+import unittest
+
+import orjson
+
+from app.services import grounding
+
+SOURCE = (
+    "Overall survival improved with treatment (HR=0.64, 95% CI 0.58-0.71, p<0.001). "
+    "Nausea was reported in 12% of patients and grade 3 neutropenia in 3%."
+)
+
+
+class SelfCorrectionTest(unittest.TestCase):
+    def setUp(self):
+        grounding._result_cache.clear()
+        grounding._llm_cache.clear()
+        self.prompts = []
+        self.verdicts = []
+        self.corrections = []
+        self._real_completion = grounding._cached_completion
+
+        async def fake_completion(messages, max_tokens):
+            prompt = messages[-1]["content"]
+            self.prompts.append(prompt)
+            if prompt.startswith("You are a REGULATORY COMPLIANCE AUDITOR"):
+                return orjson.dumps({"results": self.verdicts}).decode()
+            return orjson.dumps({"corrections": self.corrections}).decode()
+
+        grounding._cached_completion = fake_completion
+
+    def tearDown(self):
+        grounding._cached_completion = self._real_completion
+
+    def _validate_and_correct(self, output: dict) -> dict:
+        async def run():
+            result = await grounding.validate_grounding(output, SOURCE)
+            corrected, _ = await grounding.correct_ungrounded_claims(output, SOURCE, result)
+            return corrected
+        return asyncio.run(run())
+
+    @staticmethod
+    def _failed(suggestion) -> dict:
+        return {"grounded": False, "severity": "error", "reason": "not in text", "suggested_correction": suggestion}
+
+    def test_judge_sees_safety_label_apart_from_text(self):
+        self.verdicts = [{"grounded": True, "severity": "ok", "reason": "ok"}]
+        self._validate_and_correct({"safety_profile": {"adverse_events": ["nausea (12%)"]}})
+        self.assertIn("[Claim 1] (Adverse event): nausea (12%)", self.prompts[0])
+
+    def test_suggested_safety_correction_is_stored_without_label(self):
+        self.verdicts = [
+            self._failed("Adverse event: nausea (12%)"),
+            self._failed("Serious adverse event: grade 3 neutropenia (3%)"),
+        ]
+        corrected = self._validate_and_correct({
+            "safety_profile": {
+                "adverse_events": ["nausea (40%)"],
+                "serious_adverse_events": ["grade 3 neutropenia (9%)"],
+            },
+        })
+        self.assertEqual(corrected["safety_profile"]["adverse_events"], ["nausea (12%)"])
+        self.assertEqual(corrected["safety_profile"]["serious_adverse_events"], ["grade 3 neutropenia (3%)"])
+        self.assertEqual(len(self.prompts), 1)  # applied without a correction call
+
+    def test_pending_safety_correction_is_stored_without_label(self):
+        self.verdicts = [{"grounded": False, "severity": "error", "reason": "not in text"}]
+        self.corrections = [{
+            "error_index": 1, "action": "correct", "type": "safety_claim",
+            "original_index": 0, "corrected_value": "Adverse event: nausea (12%)",
+        }]
+        corrected = self._validate_and_correct({"safety_profile": {"adverse_events": ["nausea (40%)"]}})
+        self.assertEqual(corrected["safety_profile"]["adverse_events"], ["nausea (12%)"])
+
+    def test_string_suggestion_for_finding_with_evidence_goes_to_correction_call(self):
+        self.verdicts = [self._failed("Overall survival improved (HR=0.64)")]
+        self.corrections = [{
+            "error_index": 1, "action": "correct", "type": "key_finding", "original_index": 0,
+            "corrected_value": {"finding": "Overall survival improved", "statistical_evidence": "HR=0.64, p<0.001"},
+        }]
+        corrected = self._validate_and_correct({
+            "key_findings": [{"finding": "Overall survival doubled", "statistical_evidence": "HR=0.64, p<0.05"}],
+        })
+        self.assertEqual(len(self.prompts), 2)
+        self.assertEqual(corrected["key_findings"][0], {
+            "finding": "Overall survival improved", "statistical_evidence": "HR=0.64, p<0.001",
+        })
+
+    def test_object_suggestion_for_finding_rewrites_both_fields(self):
+        self.verdicts = [self._failed({"finding": "Overall survival improved", "statistical_evidence": "HR=0.64, p<0.001"})]
+        corrected = self._validate_and_correct({
+            "key_findings": [{"finding": "Overall survival doubled", "statistical_evidence": "HR=0.64, p<0.05"}],
+        })
+        self.assertEqual(len(self.prompts), 1)
+        self.assertEqual(corrected["key_findings"][0], {
+            "finding": "Overall survival improved", "statistical_evidence": "HR=0.64, p<0.001",
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
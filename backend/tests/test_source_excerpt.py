@@ -0,0 +1,60 @@
+"""
+_source_excerpt with the real o200k_base encoding.
+
+tiktoken downloads the BPE file on first use; offline, point
+TIKTOKEN_CACHE_DIR at a directory that already holds it, or these skip.
+
+Run from backend/:  python -m unittest discover -s tests
+"""
+
+import os
+import unittest
+
+import fitz
+
+from app.services.grounding import SOURCE_HEAD_TOKENS, SOURCE_TAIL_TOKENS, _get_encoding, _source_excerpt
+
+SAMPLE_PAPER = os.path.join(os.path.dirname(__file__), "..", "..", "sample_papers", "12885_2025_Article_13757.pdf")
+MARKER = "\n\n[...middle sections omitted for length...]\n\n"
+
+
+def _pdf_text(path: str) -> str:
+    with fitz.open(path) as doc:
+        return "\n".join(page.get_text() for page in doc)
+
+
+@unittest.skipIf(_get_encoding() is None, "o200k_base BPE file unavailable (offline, no TIKTOKEN_CACHE_DIR)")
+class SourceExcerptTest(unittest.TestCase):
+    def setUp(self):
+        _source_excerpt.cache_clear()
+        self.enc = _get_encoding()
+
+    def test_encoding_is_o200k_base(self):
+        self.assertEqual(self.enc.name, "o200k_base")
+
+    def test_short_text_unchanged(self):
+        text = "Median overall survival was 14.6 months (HR=0.64, 95% CI 0.58-0.71)."
+        self.assertEqual(_source_excerpt(text), text)
+
+    def test_paper_keeps_head_and_tail_tokens(self):
+        text = _pdf_text(SAMPLE_PAPER)
+        tokens = self.enc.encode(text, disallowed_special=())
+        self.assertGreater(len(tokens), SOURCE_HEAD_TOKENS + SOURCE_TAIL_TOKENS)
+
+        excerpt = _source_excerpt(text)
+        head, tail = excerpt.split(MARKER)
+        self.assertEqual(head, self.enc.decode(tokens[:SOURCE_HEAD_TOKENS]))
+        self.assertEqual(tail, self.enc.decode(tokens[-SOURCE_TAIL_TOKENS:]))
+        self.assertTrue(text.startswith(head))
+        self.assertTrue(text.endswith(tail))
+        self.assertLess(len(excerpt), len(text))
+
+    def test_special_token_text_is_encoded_as_plain_text(self):
+        text = "<|endoftext|> " * (SOURCE_HEAD_TOKENS + SOURCE_TAIL_TOKENS)
+        head, tail = _source_excerpt(text).split(MARKER)
+        self.assertTrue(text.startswith(head))
+        self.assertTrue(text.endswith(tail))
+
+
+if __name__ == "__main__":
+    unittest.main()